@@ -0,0 +1,217 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import contextlib
+import numpy as np
+from synthetic import random_swc, random_nml, random_zip, cube_grid
+
+for folder in ('nml_tools', 'swc_tools', 'hoc_tools', 'zip_tools', 'common_tools'):
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, folder))
+from nml2swc import convert_nml
+from nml_merger import merge_nml
+from nml_splitter import split_nml
+from morphology import load_swc
+import swc2hoc
+import swc2obj
+from swc_components import components
+from swc_cyclebreaker import redraw
+from swc_smoother import swc_smooth
+from hoc_scaler import scale
+from zip_splitter import split_zip
+from zip_stats import label_index
+from zip_mesh import mesh_zip
+from batch import pop_option
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+# nodes per input; zip benchmarks read the size as a number of cubes
+NODE_SIZES = (1000, 10000, 100000)
+CUBE_SIZES = (1, 2, 4, 8)
+
+# a run is flagged when its time grows with size by a power this much higher
+# than the baseline's, or when it takes this many times as long as the
+# baseline at the same size; times vary between machines, exponents much less
+EXPONENT_TOLERANCE = 0.25
+SLOWDOWN_TOLERANCE = 3.0
+
+# runs shorter than this are mostly start up costs and timer noise, so they
+# are never flagged as slower on their own
+NOISE_SECONDS = 0.05
+
+# each benchmark writes its input to a scratch directory and returns the
+# call to time; inputs are made outside the timed call
+
+def nml2swc_input(directory, size):
+    path = random_nml(os.path.join(directory, 'skeleton.nml'), size)
+    return lambda: convert_nml(path)
+
+def nml_merger_input(directory, size):
+    folder = os.path.join(directory, 'skeletons')
+    os.mkdir(folder)
+    for i in range(10):
+        random_nml(os.path.join(folder, 'skeleton%02d.nml' % i), max(size // 10, 1), things=2, seed=i)
+    return lambda: merge_nml(folder, os.path.join(directory, 'merged.nml'), 1)
+
+def nml_splitter_input(directory, size):
+    path = random_nml(os.path.join(directory, 'skeleton.nml'), size)
+    return lambda: split_nml(path)
+
+def swc2hoc_input(directory, size):
+    path = random_swc(os.path.join(directory, 'dendrite.swc'), size)
+    soma_path = random_swc(os.path.join(directory, 'soma.swc'), 20, seed=1)
+    return lambda: swc2hoc.convert_swc(path, soma_path)
+
+def swc2obj_input(directory, size):
+    path = random_swc(os.path.join(directory, 'skeleton.swc'), size)
+    return lambda: swc2obj.convert_swc(path)
+
+def swc2obj_tube_input(directory, size):
+    path = random_swc(os.path.join(directory, 'skeleton.swc'), size)
+    return lambda: swc2obj.convert_swc(path, 'tube')
+
+def swc_components_input(directory, size):
+    path = random_swc(os.path.join(directory, 'skeleton.swc'), size, components=10)
+    return lambda: components(path)
+
+def swc_cyclebreaker_input(directory, size):
+    path = random_swc(os.path.join(directory, 'skeleton.swc'), size, components=10, loops=3)
+    return lambda: redraw(path, load_swc(path))
+
+def swc_smoother_input(directory, size):
+    path = random_swc(os.path.join(directory, 'skeleton.swc'), size)
+    return lambda: swc_smooth(path, 1.1)
+
+def hoc_scaler_input(directory, size):
+    path = random_swc(os.path.join(directory, 'dendrite.swc'), size)
+    with contextlib.redirect_stdout(io.StringIO()):
+        swc2hoc.convert_swc(path, random_swc(os.path.join(directory, 'soma.swc'), 20, seed=1))
+    return lambda: scale(path[:-4] + '.hoc', 1.1, 1.1, 2.5, 0.5)
+
+def zip_splitter_input(directory, size):
+    path = random_zip(os.path.join(directory, 'cells.zip'), cube_grid(size))
+    return lambda: split_zip(path, 1)
+
+def zip_stats_input(directory, size):
+    path = random_zip(os.path.join(directory, 'cells.zip'), cube_grid(size))
+    return lambda: label_index(path, 1)
+
+def zip_mesh_input(directory, size):
+    path = random_zip(os.path.join(directory, 'cells.zip'), cube_grid(size))
+    return lambda: mesh_zip(path, 'ply', workers=1)
+
+# name: (input maker, default sizes); every tool runs on one process so the
+# numbers measure the algorithm, not the machine's core count
+BENCHMARKS = {
+    'nml2swc': (nml2swc_input, NODE_SIZES),
+    'nml_merger': (nml_merger_input, NODE_SIZES),
+    'nml_splitter': (nml_splitter_input, NODE_SIZES),
+    'swc2hoc': (swc2hoc_input, NODE_SIZES),
+    'swc2obj': (swc2obj_input, NODE_SIZES),
+    'swc2obj_tube': (swc2obj_tube_input, NODE_SIZES),
+    'swc_components': (swc_components_input, NODE_SIZES),
+    'swc_cyclebreaker': (swc_cyclebreaker_input, NODE_SIZES),
+    'swc_smoother': (swc_smoother_input, NODE_SIZES),
+    'hoc_scaler': (hoc_scaler_input, NODE_SIZES),
+    'zip_splitter': (zip_splitter_input, CUBE_SIZES),
+    'zip_stats': (zip_stats_input, CUBE_SIZES),
+    'zip_mesh': (zip_mesh_input, CUBE_SIZES),
+}
+
+# best of repeats seconds, each on freshly written input so caches such as
+# the .npy sidecars of load_swc never carry over between runs
+def time_benchmark(name, size, repeats=1):
+    make_input = BENCHMARKS[name][0]
+    best = None
+    for _ in range(repeats):
+        directory = tempfile.mkdtemp(prefix='wktk_bench_')
+        try:
+            run = make_input(directory, size)
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                run()
+                seconds = time.perf_counter() - start
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+# slope of log(seconds) against log(size): about 1 for linear work, 2 for
+# quadratic
+def scaling_exponent(sizes, seconds):
+    if len(sizes) < 2:
+        return None
+    return float(np.polyfit(np.log(sizes), np.log(np.maximum(seconds, 1e-6)), 1)[0])
+
+def run_benchmark(name, sizes=None, repeats=1):
+    sizes = list(sizes or BENCHMARKS[name][1])
+    seconds = [time_benchmark(name, size, repeats) for size in sizes]
+    return {'sizes': sizes, 'seconds': seconds, 'exponent': scaling_exponent(sizes, seconds)}
+
+def load_baselines(baselines_path=BASELINES_PATH):
+    if not os.path.exists(baselines_path):
+        return {}
+    with open(baselines_path) as f:
+        return json.load(f)
+
+def save_baselines(results, baselines_path=BASELINES_PATH):
+    baselines = load_baselines(baselines_path)
+    baselines.update(results)
+    with open(baselines_path, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+# reasons a result is worse than its baseline; the exponent is only compared
+# when both were measured at the same sizes
+def regressions(result, baseline):
+    found = []
+    if baseline.get('exponent') is not None and result['exponent'] is not None and \
+            result['sizes'] == baseline['sizes'] and result['exponent'] > baseline['exponent'] + EXPONENT_TOLERANCE:
+        found.append('scales as n^%.2f, baseline n^%.2f' % (result['exponent'], baseline['exponent']))
+    for size, seconds in zip(result['sizes'], result['seconds']):
+        if size in baseline['sizes']:
+            before = baseline['seconds'][baseline['sizes'].index(size)]
+            if seconds > NOISE_SECONDS and seconds > SLOWDOWN_TOLERANCE * before:
+                found.append('%.2fx slower at %d' % (seconds / before, size))
+    return found
+
+def print_result(name, result, baseline):
+    exponent = '-' if result['exponent'] is None else '%.2f' % result['exponent']
+    print('%s  (n^%s)' % (name, exponent))
+    for size, seconds in zip(result['sizes'], result['seconds']):
+        before = baseline['seconds'][baseline['sizes'].index(size)] if baseline and size in baseline['sizes'] else None
+        print('  %10d  %9.3f s' % (size, seconds) + ('  baseline %9.3f s' % before if before is not None else ''))
+
+if __name__ == "__main__":
+    # -s sizes the node benchmarks, -c the cube counts of the zip ones
+    sizes = pop_option(sys.argv, ('-s', '--sizes'))
+    sizes = [int(float(size)) for size in sizes.split(',')] if sizes else None
+    cubes = pop_option(sys.argv, ('-c', '--cubes'))
+    cubes = [int(size) for size in cubes.split(',')] if cubes else None
+    repeats = int(pop_option(sys.argv, ('-r', '--repeats')) or 1)
+    save = '--save' in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != '--save']
+
+    unknown = [name for name in args if name not in BENCHMARKS]
+    if unknown:
+        print('\nBENCHMARK -- scaling benchmarks of every tool on synthetic data')
+        print('Usage: python benchmark.py [tool names...] [-s nodes,nodes,...] [-c cubes,cubes,...] [-r repeats] [--save]')
+        print('Tools: ' + ', '.join(sorted(BENCHMARKS)))
+    else:
+        baselines = load_baselines()
+        results = {}
+        flagged = 0
+        for name in args or sorted(BENCHMARKS):
+            results[name] = run_benchmark(name, cubes if BENCHMARKS[name][1] is CUBE_SIZES else sizes, repeats)
+            baseline = baselines.get(name)
+            print_result(name, results[name], baseline)
+            for reason in regressions(results[name], baseline) if baseline else []:
+                print('  REGRESSION -- ' + reason)
+                flagged += 1
+        if save:
+            save_baselines(results)
+            print('Saved baselines to ' + BASELINES_PATH)
+        sys.exit(1 if flagged and not save else 0)
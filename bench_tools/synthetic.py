@@ -0,0 +1,146 @@
+import os
+import sys
+import zipfile
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'swc_tools'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'zip_tools'))
+from morphology import Morphology, save_swc, format_rows
+from zip_splitter import VOXEL_DTYPE, COMPRESS_LEVEL
+from zip_stats import CUBE_EDGE
+
+# random skeletons and volumes in the formats the tools read, for benchmarks
+# at any size; the same seed always gives the same files
+
+# chance that a node starts a new branch off an earlier node of its tree
+# instead of extending the node before it
+BRANCH_CHANCE = 0.05
+
+# segmentation labels are drawn on a grid of blocks this many voxels wide
+LABEL_BLOCK = 32
+
+# parent row of every node for components trees of about n / components nodes
+# each, stored one after another; a tree's rows only point to earlier rows of
+# the same tree. Also returns the root row of every tree
+def random_parents(n, rng, components=1):
+    rows = np.arange(n, dtype=np.int64)
+    starts = np.unique(np.linspace(0, n, components + 1).astype(np.int64)[:-1])
+    first = starts[np.searchsorted(starts, rows, side='right') - 1]
+    parents = rows - 1
+    branching = np.flatnonzero(rng.random(n) < BRANCH_CHANCE)
+    parents[branching] = first[branching] + (rng.random(len(branching)) * (branching - first[branching])).astype(np.int64)
+    parents[starts] = -1
+    return parents, starts
+
+# sums values from each node up to its root by pointer doubling, so deep
+# trees take log(depth) vectorized passes
+def root_sums(values, parents):
+    sums = values.copy()
+    pointers = parents.copy()
+    live = np.flatnonzero(pointers != -1)
+    while len(live):
+        sums[live] += sums[pointers[live]]
+        pointers[live] = pointers[pointers[live]]
+        live = live[pointers[live] != -1]
+    return sums
+
+# a random branching forest: steps of 1 to 2 units in random directions,
+# radii shrinking away from the roots, type 1 (soma) at the roots and 3
+# (dendrite) elsewhere
+def random_morphology(n, seed=0, components=1, loops=0):
+    rng = np.random.default_rng(seed)
+    parents, starts = random_parents(n, rng, components)
+    steps = rng.normal(size=(n, 3))
+    steps *= rng.uniform(1, 2, size=(n, 1)) / np.maximum(np.linalg.norm(steps, axis=1), 1e-9)[:, None]
+    steps[starts] = rng.uniform(0, 100 * np.cbrt(n), size=(len(starts), 3))
+    xyz = root_sums(steps, parents)
+    radii = np.maximum(3.0 * 0.999 ** root_sums(np.ones(n), parents) * rng.uniform(0.8, 1.2, size=n), 0.1)
+    types = np.full(n, 3, dtype=np.int64)
+    types[starts] = 1
+
+    # close loops in the last trees, after the coordinates were laid out
+    for start in starts[::-1][:loops].tolist():
+        stop = starts[starts > start][0] if start != starts[-1] else n
+        if stop - start > 1:
+            parents[start] = rng.integers(start + 1, stop)
+            types[start] = 3
+    ids = np.arange(1, n + 1, dtype=np.int64)
+    return Morphology(ids, types, np.round(xyz, 3), np.round(radii, 3), np.where(parents == -1, -1, parents + 1))
+
+def random_swc(swc_path, n, seed=0, components=1, loops=0):
+    save_swc(random_morphology(n, seed, components, loops), swc_path)
+    return swc_path
+
+# a webKnossos style .nml with n nodes split over things, a few comments per
+# thing and some branchpoints
+def random_nml(nml_path, n, things=10, seed=0):
+    rng = np.random.default_rng(seed)
+    bounds = np.unique(np.linspace(0, n, things + 1).astype(np.int64))
+    with open(nml_path, 'w') as f:
+        f.write('<things>\n  <parameters>\n    <experiment name="synthetic"/>\n    <scale x="11.24" y="11.24" z="28.0"/>\n  </parameters>\n')
+        for i, (start, stop) in enumerate(zip(bounds[:-1].tolist(), bounds[1:].tolist()), 1):
+            m = random_morphology(stop - start, seed + i)
+            ids = m.ids + start
+            f.write('  <thing id="%d" color.r="1.0" color.g="0.0" color.b="0.0" color.a="1.0" name="Tree%03d">\n    <nodes>\n' % (i, i))
+            f.write(format_rows('      <node id="%d" radius="%.3f" x="%.3f" y="%.3f" z="%.3f" inVp="0" inMag="0" time="0"/>',
+                                (ids, m.radii, m.xyz[:, 0], m.xyz[:, 1], m.xyz[:, 2])))
+            linked = np.flatnonzero(m.parents != -1)
+            f.write('    </nodes>\n    <edges>\n')
+            f.write(format_rows('      <edge source="%d" target="%d"/>', (m.parents[linked] + start, ids[linked])))
+            f.write('    </edges>\n  </thing>\n')
+        f.write('  <branchpoints>\n')
+        f.write(format_rows('    <branchpoint id="%d"/>', (rng.integers(1, n + 1, size=max(n // 1000, 1)),)))
+        f.write('  </branchpoints>\n  <comments>\n')
+        f.write(format_rows('    <comment node="%d" content="synthetic %d"/>',
+                            (rng.integers(1, n + 1, size=3 * (len(bounds) - 1)), np.arange(3 * (len(bounds) - 1)))))
+        f.write('  </comments>\n</things>\n')
+    return nml_path
+
+# a webKnossos volume export of cubes cubes along x, y and z: a stored outer
+# zip holding data.zip with one deflated 128^3 uint16 cube per position and
+# an empty annotation.nml. Cells are blocks of LABEL_BLOCK voxels, about a
+# third of them empty, labelled 1..labels
+def random_zip(zip_path, cubes=(2, 2, 2), labels=100, seed=0):
+    rng = np.random.default_rng(seed)
+    per_cube = CUBE_EDGE // LABEL_BLOCK
+    grid = rng.integers(1, labels + 1, size=(cubes[2] * per_cube, cubes[1] * per_cube, cubes[0] * per_cube))
+    grid[rng.random(grid.shape) < 1.0 / 3] = 0
+
+    data_path = zip_path[:-4] + '_data.zip'
+    with zipfile.ZipFile(data_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=COMPRESS_LEVEL) as data:
+        for x in range(cubes[0]):
+            for y in range(cubes[1]):
+                for z in range(cubes[2]):
+                    # voxels are stored x fastest, so the cube is indexed [z, y, x]
+                    block = grid[z * per_cube:(z + 1) * per_cube, y * per_cube:(y + 1) * per_cube,
+                                 x * per_cube:(x + 1) * per_cube]
+                    cube = block.repeat(LABEL_BLOCK, 0).repeat(LABEL_BLOCK, 1).repeat(LABEL_BLOCK, 2)
+                    name = '1/x%04d/y%04d/z%04d/cells_mag1_x%04d_y%04d_z%04d.raw' % (x, y, z, x, y, z)
+                    data.writestr(name, cube.astype(VOXEL_DTYPE).tobytes())
+    try:
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as archive:
+            archive.write(data_path, 'data.zip')
+            archive.writestr('annotation.nml', '<things>\n  <parameters>\n  </parameters>\n</things>\n')
+    finally:
+        os.remove(data_path)
+    return zip_path
+
+# cubes along each axis for about count cubes in total
+def cube_grid(count):
+    edge = max(int(round(count ** (1.0 / 3))), 1)
+    return (max(int(round(float(count) / edge ** 2)), 1), edge, edge)
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (4, 5) or sys.argv[1] not in ('swc', 'nml', 'zip'):
+        print('\nSYNTHETIC -- random skeletons and volumes for benchmarks')
+        print('Usage: python synthetic.py [swc || nml || zip] ["path/to/output"] [nodes, or cubes for zip] [seed]')
+    else:
+        size = int(float(sys.argv[3]))
+        seed = int(sys.argv[4]) if len(sys.argv) == 5 else 0
+        if sys.argv[1] == 'swc':
+            random_swc(sys.argv[2], size, seed)
+        elif sys.argv[1] == 'nml':
+            random_nml(sys.argv[2], size, seed=seed)
+        else:
+            random_zip(sys.argv[2], cube_grid(size), seed=seed)
+        print(sys.argv[2])
@@ -0,0 +1,141 @@
+import os
+import json
+import itertools
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from instrument import stage
+
+# runs function(path, *args) for every path on a pool of worker processes;
+# when manifest_path is given, each result is appended to it as one json line
+# so a crashed or interrupted batch resumes without redoing finished files.
+# With an OutputCache, files whose stamp changed (or whose outputs are gone)
+# get the outputs of an earlier conversion of the same content back instead
+def run_batch(function, paths, args=(), workers=None, manifest_path=None, cache=None):
+    finished = read_manifest(manifest_path, args) if manifest_path else {}
+    todo = [path for path in paths if path not in finished or finished[path] != file_stamp(path)
+            or (cache and not cache.outputs_exist(path))]
+    skipped = len(paths) - len(todo)
+    if skipped:
+        print('Skipping ' + str(skipped) + ' file(s) already finished in ' + manifest_path)
+
+    restored = set()
+    if cache:
+        with stage('restore_cached'):
+            restored = set(path for path in todo if cache.restore(path))
+        if restored:
+            print('Restored ' + str(len(restored)) + ' unchanged file(s) from ' + cache.folder)
+            todo = [path for path in todo if path not in restored]
+
+    failed = []
+    manifest = open(manifest_path, 'a') if manifest_path else None
+    try:
+        results = itertools.chain(((path, None) for path in sorted(restored)), run_all(function, todo, args, workers))
+        for path, error in results:
+            if error:
+                failed.append(path)
+                # the full traceback is kept in the manifest
+                print('\nERROR -- ' + path + ' failed: ' + error.strip().splitlines()[-1])
+            elif cache and path not in restored:
+                cache.store(path)
+            if manifest:
+                entry = {'path': path, 'args': list(map(str, args)), 'status': 'failed' if error else 'done',
+                         'stamp': file_stamp(path), 'error': error}
+                manifest.write(json.dumps(entry) + '\n')
+                manifest.flush()
+    finally:
+        if manifest:
+            manifest.close()
+        if cache:
+            cache.evict()
+
+    print(str(len(todo) - len(failed)) + ' done, ' + str(len(restored)) + ' restored, ' + str(skipped) + ' skipped, '
+          + str(len(failed)) + ' failed')
+    return failed
+
+def run_all(function, paths, args, workers):
+    if workers == 1 or len(paths) <= 1:
+        for path in paths:
+            yield path, call(function, path, args)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = dict((pool.submit(call, function, path, args), path) for path in paths)
+        for future in as_completed(futures):
+            try:
+                error = future.result()
+            except Exception as e:
+                # the worker process itself died, e.g. out of memory
+                error = '%s: %s' % (type(e).__name__, e)
+            yield futures[future], error
+
+# runs in a worker; failures come back as text so one bad file never stops the batch
+def call(function, path, args):
+    try:
+        with stage(function.__name__):
+            function(path, *args)
+        return None
+    except Exception:
+        return traceback.format_exc()
+
+# like pool.imap, but never holds more than window results that the writer
+# has not consumed yet, keeping memory flat however many items there are
+def ordered_results(pool, function, items, window):
+    pending = deque()
+    items = iter(items)
+    for item in items:
+        pending.append((item, pool.apply_async(function, (item,))))
+        if len(pending) >= window:
+            break
+    while pending:
+        item, result = pending.popleft()
+        for next_item in items:
+            pending.append((next_item, pool.apply_async(function, (next_item,))))
+            break
+        yield item, result.get()
+
+def file_stamp(path):
+    try:
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+    except OSError:
+        return None
+
+# latest finished stamp per path for runs with the same arguments; a run
+# with other arguments since then has overwritten the outputs, and a torn
+# last line from a crash is ignored
+def read_manifest(manifest_path, args):
+    finished = {}
+    if not os.path.exists(manifest_path):
+        return finished
+    args = list(map(str, args))
+    with open(manifest_path, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get('status') == 'done' and entry.get('args') == args:
+                finished[entry['path']] = entry.get('stamp')
+            else:
+                finished.pop(entry['path'], None)
+    return finished
+
+def manifest_for(folder, tool_name):
+    return os.path.join(folder, '.' + tool_name + '_manifest.jsonl')
+
+# removes the first "flag value" pair found in argv, returning the value
+def pop_option(argv, flags):
+    for flag in flags:
+        if flag in argv:
+            i = argv.index(flag)
+            if i + 1 < len(argv):
+                value = argv[i + 1]
+                del argv[i:i + 2]
+                return value
+    return None
+
+# removes a "-j N" or "--workers N" option from argv, returning the worker count
+def pop_workers(argv):
+    workers = pop_option(argv, ('-j', '--workers'))
+    return int(workers) if workers is not None else None
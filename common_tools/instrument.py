@@ -0,0 +1,197 @@
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import platform
+import tracemalloc
+import contextlib
+import multiprocessing.util
+
+try:
+    import resource
+except ImportError:
+    # missing on windows, where peak memory is left out of the trace
+    resource = None
+
+# per stage timings and counters, off unless WKTK_TRACE names a file. Every
+# process appends one json line to it when it exits (or when a batch task
+# ends) holding the stages it ran, so traces of many runs and workers can
+# share one file and be summed with aggregate(). WKTK_TRACE_MEMORY=1 also
+# tracks python allocations per stage, which slows allocation heavy code
+TRACE_VARIABLE = 'WKTK_TRACE'
+MEMORY_VARIABLE = 'WKTK_TRACE_MEMORY'
+
+# returned by stage() while tracing is off, so a disabled stage costs one
+# function call and a global lookup
+NULL_STAGE = contextlib.nullcontext()
+
+# trace file, or None while off
+TRACE_PATH = None
+
+# the open record of this process, and the stages entered but not left
+RECORD = {}
+OPEN_STAGES = []
+
+def enable(trace_path, memory=False):
+    global TRACE_PATH
+    TRACE_PATH = os.path.abspath(trace_path)
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def disable():
+    global TRACE_PATH
+    flush()
+    TRACE_PATH = None
+
+def enabled():
+    return TRACE_PATH is not None
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macos, kilobytes elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+# the record of this process; a forked worker starts its own instead of
+# carrying on its parent's, and writes it when it exits
+def record():
+    if RECORD.get('pid') != os.getpid():
+        RECORD.clear()
+        RECORD.update({'tool': os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else 'python',
+                       'argv': sys.argv[1:], 'pid': os.getpid(), 'host': platform.node(),
+                       'started': time.time(), 'stages': {}, 'counters': {}})
+        del OPEN_STAGES[:]
+        atexit.register(flush)
+        # pool workers leave through os._exit, which skips atexit
+        multiprocessing.util.Finalize(None, flush, exitpriority=10)
+    return RECORD
+
+class Stage(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        record()
+        self.path = '/'.join([stage.name for stage in OPEN_STAGES] + [self.name])
+        self.counters = {}
+        self.rss = peak_rss_kb()
+        # nested stages reset the tracemalloc peak, so each stage keeps the
+        # highest peak its children saw
+        self.children_peak = 0
+        if tracemalloc.is_tracing():
+            self.peak_before = tracemalloc.get_traced_memory()[1]
+            tracemalloc.reset_peak()
+        OPEN_STAGES.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        if OPEN_STAGES and OPEN_STAGES[-1] is self:
+            OPEN_STAGES.pop()
+        entry = record()['stages'].setdefault(self.path, {'calls': 0, 'seconds': 0.0, 'counters': {}})
+        entry['calls'] += 1
+        entry['seconds'] += seconds
+        for name, value in self.counters.items():
+            entry['counters'][name] = entry['counters'].get(name, 0) + value
+        rss = peak_rss_kb()
+        if rss is not None:
+            entry['peak_rss_kb'] = max(entry.get('peak_rss_kb', 0), rss)
+            entry['rss_growth_kb'] = max(entry.get('rss_growth_kb', 0), rss - self.rss)
+        if tracemalloc.is_tracing():
+            peak = max(tracemalloc.get_traced_memory()[1], self.children_peak)
+            entry['peak_traced_kb'] = max(entry.get('peak_traced_kb', 0), peak // 1024)
+            if OPEN_STAGES:
+                OPEN_STAGES[-1].children_peak = max(OPEN_STAGES[-1].children_peak, self.peak_before, peak)
+        return False
+
+# times the code inside "with stage(name):"; stages nest into paths like
+# convert_swc/write_hoc, and repeated stages add up
+def stage(name):
+    if TRACE_PATH is None:
+        return NULL_STAGE
+    return Stage(name)
+
+# runs every call of the decorated function as one stage, e.g. the tasks of
+# pool workers
+def staged(name):
+    def decorate(function):
+        @functools.wraps(function)
+        def run(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return run
+    return decorate
+
+# adds value to a counter of the innermost open stage (nodes parsed, bytes
+# written...), or of the whole run outside any stage
+def count(name, value=1):
+    if TRACE_PATH is None:
+        return
+    if OPEN_STAGES and RECORD.get('pid') == os.getpid():
+        counters = OPEN_STAGES[-1].counters
+    else:
+        counters = record()['counters']
+    counters[name] = counters.get(name, 0) + int(value)
+
+# appends what this process recorded since the last flush as one json line;
+# lines are written whole in one call so processes can share the file
+def flush():
+    if TRACE_PATH is None or RECORD.get('pid') != os.getpid() or not (RECORD['stages'] or RECORD['counters']):
+        return
+    RECORD['seconds'] = time.time() - RECORD['started']
+    RECORD['peak_rss_kb'] = peak_rss_kb()
+    line = json.dumps(RECORD, sort_keys=True) + '\n'
+    with open(TRACE_PATH, 'a') as f:
+        f.write(line)
+    RECORD['stages'], RECORD['counters'] = {}, {}
+    RECORD['started'] = time.time()
+
+# sums stages over every record of the given trace files, keyed by tool and
+# stage path (e.g. swc2hoc.py/load): calls, seconds and counters add up,
+# peaks keep their maximum
+def aggregate(trace_paths):
+    totals = {}
+    runs = 0
+    for trace_path in trace_paths:
+        with open(trace_path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                runs += 1
+                trace = json.loads(line)
+                for path, entry in trace['stages'].items():
+                    total = totals.setdefault(trace['tool'] + '/' + path, {'calls': 0, 'seconds': 0.0, 'counters': {}})
+                    total['calls'] += entry['calls']
+                    total['seconds'] += entry['seconds']
+                    for name, value in entry['counters'].items():
+                        total['counters'][name] = total['counters'].get(name, 0) + value
+                    for peak in ('peak_rss_kb', 'rss_growth_kb', 'peak_traced_kb'):
+                        if peak in entry:
+                            total[peak] = max(total.get(peak, 0), entry[peak])
+    return runs, totals
+
+def print_totals(runs, totals):
+    print(str(runs) + ' run(s)')
+    print('%10s %8s %10s %10s  %s' % ('seconds', 'calls', 'peak_rss', 'traced', 'stage'))
+    for path, total in sorted(totals.items(), key=lambda item: -item[1]['seconds']):
+        counters = ', '.join('%s=%d' % item for item in sorted(total['counters'].items()))
+        print('%10.3f %8d %10s %10s  %s' % (total['seconds'], total['calls'], total.get('peak_rss_kb', '-'),
+                                            total.get('peak_traced_kb', '-'), path) + ('  (' + counters + ')' if counters else ''))
+
+# tracing is switched on for every tool, and for the workers they start, by
+# the environment
+if os.environ.get(TRACE_VARIABLE):
+    enable(os.environ[TRACE_VARIABLE], os.environ.get(MEMORY_VARIABLE, '') not in ('', '0'))
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print('\nINSTRUMENT -- per stage totals of WKTK_TRACE files')
+        print('Usage: python instrument.py ["path/to/trace.jsonl"] [more traces...]')
+        print('Record a trace with e.g. $ WKTK_TRACE=trace.jsonl python swc2hoc.py dendrite.swc soma.swc')
+    else:
+        print_totals(*aggregate(sys.argv[1:]))
@@ -0,0 +1,121 @@
+import os
+import json
+import shutil
+import hashlib
+import filecmp
+
+# content addressed store of conversion outputs, so a directory run restores
+# the outputs of inputs it has converted before (under any name, with any
+# mtime) instead of converting them again. Each entry is a folder named
+# after the hash of the tool, its parameters and the input's bytes, holding
+# the outputs as 0, 1, ...; the folder's mtime marks its last use, and the
+# least recently used entries are deleted once the store outgrows its size
+CACHE_DIR = '.wktk_cache'
+
+# the store is kept in the converted folder unless WKTK_CACHE names a shared
+# one; WKTK_CACHE_MB sets its size, 0 turns caching off
+CACHE_VARIABLE = 'WKTK_CACHE'
+SIZE_VARIABLE = 'WKTK_CACHE_MB'
+DEFAULT_MB = 1024
+
+# part of every key; bump when a tool's output format changes so entries
+# written by older versions are never restored
+CACHE_VERSION = 2
+
+class OutputCache(object):
+
+    # outputs(path) lists the files the tool writes for an input path
+    def __init__(self, folder, tool, params, outputs, max_bytes):
+        self.folder = folder
+        self.salt = json.dumps([CACHE_VERSION, tool, list(map(str, params))]).encode()
+        self.outputs = outputs
+        self.max_bytes = max_bytes
+        self.keys = {}
+
+    def key(self, path):
+        sha1 = hashlib.sha1(self.salt)
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        return sha1.hexdigest()
+
+    def entry(self, key):
+        return os.path.join(self.folder, key[:2], key)
+
+    def outputs_exist(self, path):
+        return all(os.path.exists(out_path) for out_path in self.outputs(path))
+
+    # brings back the outputs of path when an entry exists, leaving outputs
+    # that are already identical untouched; false means path must be converted
+    def restore(self, path):
+        try:
+            key = self.key(path)
+        except (IOError, OSError):
+            # unreadable inputs are left to the conversion to report
+            return False
+        self.keys[path] = key
+        entry = self.entry(key)
+        out_paths = self.outputs(path)
+        cached = [os.path.join(entry, str(i)) for i in range(len(out_paths))]
+        if not all(os.path.exists(cached_path) for cached_path in cached):
+            return False
+        for cached_path, out_path in zip(cached, out_paths):
+            if not (os.path.exists(out_path) and filecmp.cmp(cached_path, out_path, shallow=False)):
+                copy_file(cached_path, out_path)
+        os.utime(entry)
+        return True
+
+    # keeps the outputs just written for path, unless path changed while it
+    # was being converted
+    def store(self, path):
+        try:
+            key = self.key(path)
+        except (IOError, OSError):
+            return
+        entry = self.entry(key)
+        if self.keys.pop(path, key) != key or os.path.exists(entry):
+            return
+        tmp_entry = '%s.%d.tmp' % (entry, os.getpid())
+        try:
+            os.makedirs(tmp_entry, exist_ok=True)
+            for i, out_path in enumerate(self.outputs(path)):
+                shutil.copyfile(out_path, os.path.join(tmp_entry, str(i)))
+            os.rename(tmp_entry, entry)
+        except OSError:
+            # full disk, or another run stored the same entry first
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+
+    # deletes least recently used entries until the store fits its size
+    def evict(self):
+        entries = []
+        for shard in list_dir(self.folder):
+            for entry in list_dir(shard):
+                if entry.is_dir() and not entry.name.endswith('.tmp'):
+                    size = sum(item.stat().st_size for item in list_dir(entry.path))
+                    entries.append((entry.stat().st_mtime, size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+def list_dir(path):
+    try:
+        return list(os.scandir(path))
+    except OSError:
+        return []
+
+# copies through a temporary name so a crash never leaves half an output
+def copy_file(src_path, dst_path):
+    tmp_path = '%s.%d.tmp' % (dst_path, os.getpid())
+    shutil.copyfile(src_path, tmp_path)
+    os.replace(tmp_path, dst_path)
+
+# the cache of a directory run of tool, or None when caching is off
+def cache_for(folder, tool, params, outputs):
+    max_mb = float(os.environ.get(SIZE_VARIABLE, DEFAULT_MB))
+    if max_mb <= 0:
+        return None
+    cache_folder = os.environ.get(CACHE_VARIABLE) or os.path.join(folder, CACHE_DIR)
+    return OutputCache(cache_folder, tool, params, outputs, int(max_mb * (1 << 20)))
@@ -2,116 +2,86 @@ import glob
 import os
 import re
 import sys
-import defusedxml.ElementTree as ET
+import numpy as np
+from nml_reader import read_nml
 
-def write_swc(nmls_path, radius=0):
-    node_radius = radius
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'swc_tools'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common_tools'))
+from morphology import Morphology, save_swc
+from transform import scaling
+from batch import run_batch, manifest_for, pop_workers
+from instrument import stage
+from output_cache import cache_for
 
-    # store paths to nmls
-    nmls = []
+# z voxel size relative to x and y in our webKnossos datasets
+Z_ANISOTROPY = 5.4545
+
+# comments matching these patterns give their node a special swc type
+COMMENT_TYPES = (('[Ii][Nn][Pp][Uu][Tt]', 7), ('[Ll][Oo][Ss][Tt]', 6), ('[Mm][Yy][Ee][Ll][Ii][Nn]', 0))
+
+def write_swc(nmls_path, radius=0, workers=None):
+    print('\nConverting .nml files...')
     if os.path.isdir(nmls_path):
         nmls = glob.glob(os.path.normpath(nmls_path) + '/*.nml')
+        cache = cache_for(nmls_path, 'nml2swc', (radius, Z_ANISOTROPY), swc_outputs)
+        run_batch(convert_nml, nmls, (radius,), workers, manifest_for(nmls_path, 'nml2swc'), cache)
     else:
-        nmls.append(nmls_path)
-
-    # create paths for resulting swcs
-    swcs = []
-    for nml in nmls:
-        swcs.append(nml[:-4] + '.swc')
-    for swc in swcs:
-        if os.path.exists(swc):
-            os.remove(swc)
-
-    print('\nReading from .nml files...')
-    nml_count = -1
-    for nml in nmls:
-        nml_count += 1
-        tree = ET.parse(nml)
-        thing_list = tree.findall('thing')
-        for thing in thing_list:
-            nodes = thing.find('nodes')
-            edges = thing.find('edges')
-            comments = thing.find('comments')
-
-            child_parent = []
-            for edge in edges.findall('edge'):
-                child = edge.get('target')
-                parent = edge.get('source')
-                child_parent.append((child, parent))
+        convert_nml(nmls_path, radius)
 
-            child_list = [pair[0] for pair in child_parent]
-            node_id, node_x, node_y, node_z, node_parent = ['']*5
+def swc_outputs(nml):
+    return [nml[:-4] + '.swc']
 
-            # parse comments to give special type to some swc nodes later
-            id_to_type = {}
-            for comment in comments.findall('comment'):
-                comment_text = comment.get('content')
-                if re.search('[Ii][Nn][Pp][Uu][Tt]', comment_text):
-                    id_to_type[comment.get('node')] = 7
-                elif re.search('[Ll][Oo][Ss][Tt]', comment_text):
-                    id_to_type[comment.get('node')] = 6
-                elif re.search('[Mm][Yy][Ee][Ll][Ii][Nn]', comment_text):
-                    id_to_type[comment.get('node')] = 0
+def convert_nml(nml, radius=0):
+    swc = swc_outputs(nml)[0]
+    morphology = nml_to_morphology(nml, radius)
+    with stage('save_swc'):
+        save_swc(morphology, swc)
+    print(swc)
 
-            for node in nodes.findall('node'):
-                node_id = node.get('id')
-                node_x = float(node.get('x'))
-                node_y = float(node.get('y'))
-                node_z = float(node.get('z')) * 5.4545
-                if node_radius == 0:
-                    node_radius = node.get('radius')
+# converts every thing of an nml into one morphology numbered 1..N in
+# document order; parents come from each thing's edges (source is parent)
+def nml_to_morphology(nml_path, radius=0):
+    with stage('read_nml'):
+        _, things, comments, _ = read_nml(nml_path)
+    if not things:
+        return Morphology([], [], np.empty((0, 3)), [], [])
+    with stage('build'):
+        return things_to_morphology(things, comments, radius)
 
-                if node_id in child_list:
-                    node_parent = child_parent[child_list.index(node_id)][1]
-                else:
-                    node_parent = -1
-
-                swc = open(swcs[nml_count], 'a')
-                if node_id in id_to_type:
-                    node_type = id_to_type[node_id]
-                else:
-                    node_type = 3
-                swc.write(str(node_id) + ' ' + str(node_type) + ' ' + str(node_x) + ' ' + str(node_y) + ' ' + str(node_z) + ' ' + str(node_radius) + ' ' + str(node_parent) + '\n')
-                swc.close()
-
-    # correct indexing: enforce consecutive natural numbering
-    print('Writing final .swc files...')
-    for swc in swcs:
-        lines_to_write = correct(swc, child_list, child_parent, node_id)
-        f = open(swc, 'w')
-        for line in lines_to_write:
-            f.write(line + '\n')
-        f.close()
-        print(swc)
-
-def correct(swc, child_list, child_parent, node_id):
-    lines_to_write = []
-    index_map = {'-1':-1}
-    f = open(swc, 'r')
-    lines = f.readlines()
-    f.close()
-    n = 1
-    for line in lines:
-        index_map[line.split(' ')[0]] = n
-        n += 1
+def things_to_morphology(things, comments, radius=0):
+    offsets = np.cumsum([0] + [len(thing) for thing in things])
+    parents = np.concatenate([np.where(rows == -1, -1, rows + offset + 1)
+                              for rows, offset in zip((thing.parent_rows() for thing in things), offsets)])
+    ids = np.concatenate([thing.ids for thing in things])
+    xyz = np.concatenate([thing.xyz for thing in things])
+    xyz = scaling(1.0, 1.0, Z_ANISOTROPY).apply_points(xyz)
+    if float(radius) == 0:
+        radii = np.concatenate([thing.radii for thing in things])
+    else:
+        radii = np.full(len(ids), float(radius))
 
-    for line in lines:
-        line = str(index_map[line.split(' ')[0]]) + line[len(line.split(' ')[0]):]
-        lines_to_write.append(line)
+    # parse comments to give special type to some swc nodes
+    comment_nodes = np.concatenate([thing.comment_nodes for thing in things] + [comments[0]])
+    comment_texts = np.concatenate([thing.comment_texts for thing in things] + [comments[1]])
+    types = np.full(len(ids), 3, dtype=np.int64)
+    id_to_row = dict(zip(ids.tolist(), range(len(ids))))
+    for node, text in zip(comment_nodes.tolist(), comment_texts.tolist()):
+        if node not in id_to_row:
+            continue
+        for pattern, node_type in COMMENT_TYPES:
+            if re.search(pattern, text):
+                types[id_to_row[node]] = node_type
+                break
 
-    n = 0
-    for line in lines_to_write:
-        line = line[:-len(line.split(' ')[6])] + str(index_map[(line.split(' ')[6])[:-1]])
-        lines_to_write[n] = line
-        n += 1
-    return lines_to_write
+    return Morphology(np.arange(1, len(ids) + 1), types, xyz, radii, parents)
 
 if __name__ == "__main__":
+    workers = pop_workers(sys.argv)
     if len(sys.argv) < 2 or len(sys.argv) > 3:
         print('\nNML2SWC -- Written by Nathan Spencer 2016')
-        print('Usage: python nml2swc.py ["path/to/nml/file.nml" || "path/to/nml/folder"] [radius]')
+        print('Usage: python nml2swc.py ["path/to/nml/file.nml" || "path/to/nml/folder"] [radius] [-j workers]')
         print('Note: radius argument is optional; radius from nml will be used by default')
     elif len(sys.argv) == 2:
-        write_swc(sys.argv[1])
+        write_swc(sys.argv[1], workers=workers)
     else:
-        write_swc(sys.argv[1], sys.argv[2])
+        write_swc(sys.argv[1], sys.argv[2], workers)
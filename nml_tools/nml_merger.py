@@ -1,104 +1,150 @@
-import xmltodict
 import os
-import math
-import glob
-from xml.etree.ElementTree import Element, SubElement, ElementTree
 import sys
-import lxml.etree as etree
 import fnmatch
-
-def merge_nml(skeleton_folder, file_to_write):
-    skeleton_folder = sys.argv[1]
-    file_to_write = sys.argv[2]
-    files_to_merge = glob.glob(skeleton_folder + '/*.nml')
-
+import multiprocessing
+from xml.sax.saxutils import quoteattr, escape
+import numpy as np
+from nml_reader import iter_nml
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common_tools'))
+from batch import ordered_results, pop_workers
+from instrument import stage, staged, count
+
+# node attributes written for every merged node, with the values used when
+# an input file (e.g. an older export) does not provide them
+NODE_DEFAULTS = (('rotX', '0'), ('rotY', '0'), ('rotZ', '0'), ('inVp', '0'), ('inMag', '0'),
+                 ('bitDepth', '8'), ('interpolation', 'false'), ('time', '0'))
+COLORS = ('color.r', 'color.g', 'color.b', 'color.a')
+
+def merge_nml(skeleton_folder, file_to_write, workers=None):
     files_to_merge = []
     for root, _, filenames in os.walk(skeleton_folder, followlinks=True):
-        for filename in fnmatch.filter(filenames, '*.nml'):
+        for filename in sorted(fnmatch.filter(filenames, '*.nml')):
             files_to_merge.append(os.path.join(root, filename))
 
-    things = Element('things')
-
-    nodeCount = 0
     thingCount = 0
-    for ii, filename in enumerate(files_to_merge):
-       try:
-            thingCount += 1
-
-            with open(filename) as fd:
-                doc = xmltodict.parse(fd.read())
-
-            if ii == 0:
-                parameters = SubElement(things, 'parameters')
-                SubElement(parameters, 'experiment', {'name ': doc['things']['parameters']['experiment']['@name']})
-            print filename
-
-            nodeCount = buildTree(doc, things, thingCount, nodeCount)
-      
-       except KeyError, e:
-        print '\nERROR -- File ' + filename + ' is malformed or empty, try redownloading it.\nKeyError: ' + str(e) + '\n'
-
-    tree = ElementTree(things)
-    tree.write(file_to_write)
-    x = etree.parse(file_to_write)
-    f = open(file_to_write, "w")
-    f.write(etree.tostring(x, pretty_print=True))
-    f.close()
-
-
-def buildTree(doc, things, thingCount, nodeCount):
-  thing = SubElement(things, 'thing', {'id': str(thingCount),
-    'color.r': doc['things']['thing']['@color.r'],
-    'color.g': doc['things']['thing']['@color.g'],
-    'color.b': doc['things']['thing']['@color.b'],
-    'color.a': doc['things']['thing']['@color.a'],
-    'name': 'Tree' + str(thingCount)})
-
-  nodes = SubElement(thing, 'nodes')
-  lastNodeCount = nodeCount
-
-  for node in doc['things']['thing']['nodes']['node']:
-
-      translateX = 0
-      translateY = 0
-
-      if node.get('@rotX') == None:
-          node['@rotX'] = '0'
-          node['@rotY'] = '0'
-          node['@rotZ'] = '0'
-          node['@inMag'] = '0'
-          node['@bitDepth'] = '8'
-          node['@interpolation'] = 'false'
-
-          translateX = int(math.floor(float(doc['things']['parameters']['skeletonVPState'].get('@translateX'))))
-          translateY = int(math.floor(float(doc['things']['parameters']['skeletonVPState'].get('@translateY'))))
-
-      node = SubElement(nodes, 'node', {'id': str(int(node['@id']) + lastNodeCount),
-                                        'radius': node['@radius'],
-                                        'x': str(int(node['@x']) - translateX + translateX),
-                                        'y': str(int(node['@y']) - translateY + translateY),
-                                        'z': node['@z'],
-                                        'rotX': node['@rotX'],
-                                        'rotY': node['@rotY'],
-                                        'rotZ': node['@rotZ'],
-                                        'inVp': node['@inVp'],
-                                        'inMag': node['@inMag'],
-                                        'bitDepth': node['@bitDepth'],
-                                        'interpolation': node['@interpolation'],
-                                        'time': node['@time']})
-
-      nodeCount = int(node.attrib['id']) + lastNodeCount
-
-  edges = SubElement(thing, 'edges')
-  for edge in doc['things']['thing']['edges']['edge']:
-      edge = SubElement(edges, 'edge', {'source': (str(int(edge['@source']) + lastNodeCount)),
-                                        'target': (str(int(edge['@target']) + lastNodeCount))})
-  return nodeCount
+    nodeCount = 0
+    comments = []
+    branchpoints = []
+    f = None
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        for filename, parsed in ordered_results(pool, parse_file, files_to_merge, 2 * (workers or os.cpu_count() or 1)):
+            if isinstance(parsed, str):
+                print('\nERROR -- File ' + filename + ' is malformed or empty, try redownloading it.\n' + parsed + '\n')
+                continue
+            print(filename)
+
+            if f is None:
+                f = open(file_to_write, 'w')
+                f.write('<things>\n  <parameters>\n    <experiment name=%s/>\n  </parameters>\n'
+                        % quoteattr(parsed['experiment']))
+
+            # node ids of each file are dense (1..n), so its offset is the
+            # running sum of the node counts of the files before it
+            with stage('write_things'):
+                for thing in parsed['things']:
+                    thingCount += 1
+                    write_thing(f, thing, thingCount, nodeCount)
+                count('nodes_written', parsed['count'])
+            comments.extend((node + nodeCount, text) for node, text in parsed['comments'])
+            branchpoints.extend(node + nodeCount for node in parsed['branchpoints'])
+            nodeCount += parsed['count']
+    finally:
+        pool.close()
+        pool.join()
+
+    if f is None:
+        f = open(file_to_write, 'w')
+        f.write('<things>\n')
+    with stage('write_annotations'):
+        f.write('  <branchpoints>\n')
+        f.write(''.join('    <branchpoint id="%d"/>\n' % node for node in branchpoints))
+        f.write('  </branchpoints>\n  <comments>\n')
+        f.write(''.join('    <comment node="%d" content=%s/>\n' % (node, quoteattr(text)) for node, text in comments))
+        f.write('  </comments>\n</things>\n')
+        f.close()
+
+# runs in a worker: parses one file and renumbers its nodes 1..n in document
+# order; returns an error message instead when the file cannot be merged
+@staged('parse_file')
+def parse_file(filename):
+    try:
+        experiment = ''
+        things = []
+        comment_nodes, comment_texts, branchpoints = [], [], []
+        for kind, value in iter_nml(filename, keep_extra=True):
+            if kind == 'parameters':
+                experiment_elem = value.find('experiment')
+                if experiment_elem is not None:
+                    experiment = experiment_elem.get('name', '')
+            elif kind == 'thing':
+                things.append(value)
+                comment_nodes.append(value.comment_nodes)
+                comment_texts.append(value.comment_texts)
+            elif kind == 'comments':
+                comment_nodes.append(value[0])
+                comment_texts.append(value[1])
+            elif kind == 'branchpoints':
+                branchpoints.append(value)
+        if not things:
+            return 'No <thing> found.'
+
+        ids = np.concatenate([thing.ids for thing in things])
+        order = np.argsort(ids, kind='stable')
+        sorted_ids = ids[order]
+
+        def local(node_ids):
+            node_ids = np.asarray(node_ids, dtype=np.int64)
+            pos = np.minimum(np.searchsorted(sorted_ids, node_ids), len(sorted_ids) - 1)
+            return np.where(sorted_ids[pos] == node_ids, order[pos] + 1, 0)
+
+        merged = []
+        for thing in things:
+            edges = local(thing.edges.ravel()).reshape(-1, 2)
+            merged.append({'attrib': thing.attrib, 'ids': local(thing.ids), 'xyz': thing.xyz,
+                           'radii': thing.radii, 'extra': thing.extra,
+                           'edges': edges[(edges != 0).all(axis=1)]})
+
+        nodes = local(np.concatenate(comment_nodes)) if comment_nodes else np.empty(0, dtype=np.int64)
+        texts = np.concatenate(comment_texts) if comment_texts else []
+        points = local(np.concatenate(branchpoints)) if branchpoints else np.empty(0, dtype=np.int64)
+        return {'experiment': experiment, 'things': merged, 'count': len(ids),
+                'comments': [(node, text) for node, text in zip(nodes.tolist(), list(texts)) if node],
+                'branchpoints': [node for node in points.tolist() if node]}
+    except Exception as e:
+        return '%s: %s' % (type(e).__name__, e)
+
+def write_thing(f, thing, thing_id, offset):
+    attrib = thing['attrib']
+    f.write('  <thing id="%d" %s name="Tree%d">\n    <nodes>\n'
+            % (thing_id, ' '.join('%s=%s' % (c, quoteattr(attrib.get(c, '1.0'))) for c in COLORS), thing_id))
+
+    n = len(thing['ids'])
+    extra = thing['extra']
+    columns = [(thing['ids'] + offset).tolist(), thing['radii'].tolist(),
+               thing['xyz'][:, 0].tolist(), thing['xyz'][:, 1].tolist(), thing['xyz'][:, 2].tolist()]
+    for name, default in NODE_DEFAULTS:
+        values = extra.get(name)
+        columns.append([escape(v or default, {'"': '&quot;'}) for v in values] if values is not None else [default] * n)
+    node_format = ('      <node id="%d" radius="%.10g" x="%.10g" y="%.10g" z="%.10g" '
+                   + ' '.join('%s="%%s"' % name for name, _ in NODE_DEFAULTS) + '/>\n')
+    if n:
+        f.write((node_format * n) % tuple(v for row in zip(*columns) for v in row))
+
+    f.write('    </nodes>\n    <edges>\n')
+    edges = thing['edges'] + offset
+    if len(edges):
+        f.write(('      <edge source="%d" target="%d"/>\n' * len(edges)) % tuple(edges.ravel().tolist()))
+    f.write('    </edges>\n  </thing>\n')
 
 
 if __name__ == "__main__":
+    workers = pop_workers(sys.argv)
     if len(sys.argv) != 3:
         print('\nNML_MERGER -- Written by Nathan Spencer, Micahel Morehead, Anna Whelan 2016')
-        print('Usage: python nml_merger.py ["path/to/nml/folder"] ["path/to/output/file.nml"]')
+        print('Usage: python nml_merger.py ["path/to/nml/folder"] ["path/to/output/file.nml"] [-j workers]')
+        print('Note: workers argument is optional; one worker per cpu is used by default')
     else:
-        merge_nml(sys.argv[1], sys.argv[2])
+        merge_nml(sys.argv[1], sys.argv[2], workers)
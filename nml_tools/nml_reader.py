@@ -0,0 +1,149 @@
+import os
+import sys
+import numpy as np
+import defusedxml.ElementTree as ET
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common_tools'))
+from instrument import count, enabled
+
+# node attributes kept as numeric columns, anything else goes to Thing.extra
+NODE_COLUMNS = ('id', 'x', 'y', 'z', 'radius')
+
+class Thing(object):
+
+    def __init__(self, attrib, ids, xyz, radii, edges, comment_nodes, comment_texts, extra=None):
+        self.attrib = attrib
+        self.ids = ids
+        self.xyz = xyz
+        self.radii = radii
+        # one (source, target) row per edge; the source is the parent
+        self.edges = edges
+        self.comment_nodes = comment_nodes
+        self.comment_texts = comment_texts
+        self.extra = extra if extra is not None else {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    # row of each node's parent within this thing, -1 for roots
+    def parent_rows(self):
+        parent_rows = np.full(len(self.ids), -1, dtype=np.int64)
+        if len(self.edges) == 0:
+            return parent_rows
+        order = np.argsort(self.ids, kind='stable')
+        sorted_ids = self.ids[order]
+        rows = []
+        for column in (self.edges[:, 0], self.edges[:, 1]):
+            pos = np.minimum(np.searchsorted(sorted_ids, column), len(sorted_ids) - 1)
+            rows.append(np.where(sorted_ids[pos] == column, order[pos], -1))
+        valid = (rows[0] != -1) & (rows[1] != -1)
+        parent_rows[rows[1][valid]] = rows[0][valid]
+        return parent_rows
+
+class ThingBuilder(object):
+
+    def __init__(self, attrib, keep_extra):
+        self.attrib = dict(attrib)
+        self.keep_extra = keep_extra
+        self.columns = dict((name, []) for name in NODE_COLUMNS)
+        self.extra = {}
+        self.edges = []
+        self.comment_nodes = []
+        self.comment_texts = []
+
+    def add_node(self, attrib):
+        for name in NODE_COLUMNS:
+            self.columns[name].append(attrib.get(name, 0))
+        if self.keep_extra:
+            n = len(self.columns['id'])
+            for name, value in attrib.items():
+                if name not in self.columns:
+                    self.extra.setdefault(name, [''] * (n - 1)).append(value)
+            for values in self.extra.values():
+                if len(values) < n:
+                    values.append('')
+
+    def build(self):
+        c = self.columns
+        xyz = np.array([c['x'], c['y'], c['z']], dtype=np.float64).T.reshape(-1, 3)
+        edges = np.array(self.edges, dtype=np.int64).reshape(-1, 2)
+        extra = dict((name, np.array(values, dtype=object)) for name, values in self.extra.items())
+        return Thing(self.attrib, np.array(c['id'], dtype=np.int64), xyz,
+                     np.array(c['radius'], dtype=np.float64), edges,
+                     np.array(self.comment_nodes, dtype=np.int64),
+                     np.array(self.comment_texts, dtype=object), extra)
+
+# streams an nml, yielding ('parameters', element), ('thing', Thing),
+# ('comments', (node ids, texts)) and ('branchpoints', node ids) as each block
+# closes; finished elements are detached so memory is bounded by one thing
+def iter_nml(nml_path, keep_extra=False):
+    stack = []
+    in_parameters = 0
+    thing = None
+    comment_nodes, comment_texts, branchpoints = [], [], []
+
+    for event, elem in ET.iterparse(nml_path, events=('start', 'end')):
+        tag = elem.tag
+        if event == 'start':
+            stack.append(elem)
+            if tag == 'thing':
+                thing = ThingBuilder(elem.attrib, keep_extra)
+            elif tag == 'parameters':
+                in_parameters += 1
+            continue
+
+        stack.pop()
+        if tag == 'parameters':
+            in_parameters -= 1
+        if tag == 'node' and thing is not None:
+            thing.add_node(elem.attrib)
+        elif tag == 'edge' and thing is not None:
+            thing.edges.append((int(elem.get('source')), int(elem.get('target'))))
+        elif tag == 'comment':
+            # older files keep comments inside their thing
+            if thing is not None:
+                thing.comment_nodes.append(int(elem.get('node')))
+                thing.comment_texts.append(elem.get('content', ''))
+            else:
+                comment_nodes.append(int(elem.get('node')))
+                comment_texts.append(elem.get('content', ''))
+        elif tag == 'branchpoint':
+            branchpoints.append(int(elem.get('id')))
+        elif tag == 'thing':
+            built = thing.build()
+            count('nodes_parsed', len(built))
+            yield 'thing', built
+            thing = None
+        elif tag == 'parameters' and len(stack) == 1:
+            yield 'parameters', elem
+        elif tag == 'comments' and thing is None:
+            yield 'comments', (np.array(comment_nodes, dtype=np.int64), np.array(comment_texts, dtype=object))
+            comment_nodes, comment_texts = [], []
+        elif tag == 'branchpoints' and thing is None:
+            yield 'branchpoints', np.array(branchpoints, dtype=np.int64)
+            branchpoints = []
+
+        # parameters stay whole until they are yielded, everything else is
+        # detached from its parent as soon as it has been read
+        if stack and not in_parameters:
+            stack[-1].remove(elem)
+
+    if enabled():
+        count('bytes_read', os.path.getsize(nml_path))
+
+# reads a whole nml into things plus its top-level comments and branchpoints
+def read_nml(nml_path, keep_extra=False):
+    parameters = None
+    things = []
+    comments = (np.empty(0, dtype=np.int64), np.empty(0, dtype=object))
+    branchpoints = np.empty(0, dtype=np.int64)
+    for kind, value in iter_nml(nml_path, keep_extra):
+        if kind == 'parameters':
+            parameters = value
+        elif kind == 'thing':
+            things.append(value)
+        elif kind == 'comments':
+            comments = (np.concatenate((comments[0], value[0])), np.concatenate((comments[1], value[1])))
+        elif kind == 'branchpoints':
+            branchpoints = np.concatenate((branchpoints, value))
+    return parameters, things, comments, branchpoints
@@ -2,96 +2,128 @@ import os
 import re
 import sys
 import glob
-import code
 
-def split_nmls(nmls_path):
-    files_to_parse = []
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common_tools'))
+from batch import run_batch, manifest_for, pop_workers
+from instrument import stage, staged, count
+
+THING_START = re.compile(r'<thing\b')
+THING_NAME = re.compile(r'<thing\b[^>]*\bname="(.*?)"')
+NODE_ID = re.compile(r'<node\b[^>]*\bid="(-?\d+)"')
+COMMENT_NODE = re.compile(r'<comment\b[^>]*\bnode="(-?\d+)"')
+BRANCHPOINT_ID = re.compile(r'<branchpoint\b[^>]*\bid="(-?\d+)"')
+
+# the files of a directory are split in parallel; webKnossos exports share
+# thing names, so their outputs are prefixed with the input's name to keep
+# every worker writing files of its own
+def split_nmls(nmls_path, workers=None):
     if os.path.isdir(nmls_path):
         files_to_parse = glob.glob(os.path.normpath(nmls_path) + '/*.nml')
+        run_batch(split_nml, files_to_parse, (True,), workers, manifest_for(nmls_path, 'nml_splitter'))
     else:
-        files_to_parse.append(nmls_path)
-
-    # For each file passed as an argument...
-    for file_to_parse in files_to_parse:
-        split_nml(file_to_parse)
+        split_nml(nmls_path)
 
     print('Splitting complete!')
 
-def split_nml(nml_path):
-    files_to_write, nodes_in_thing, comment_nodes, comments =  [[] for i in range(4)]
+# copies each <thing> to its own file in one pass over the input; a node id to
+# thing index routes every comment and branchpoint to its file in O(1), and
+# only one output file is open at any time
+@staged('split_nml')
+def split_nml(nml_path, prefixed=False):
     parameters_lines = ['<things>\n']
-
-    number_of_skeletons = 0
-    f_read = open(nml_path, 'r')
-    line = '\n'
+    paths_to_write = []
+    node_to_thing = {}
+    comments = []
+    branchpoints = []
 
     parameters_flag = False
-    thing_flag = False
     comments_flag = False
+    branchpoints_flag = False
+    current_file = None
+
+    f_read = open(nml_path, 'r')
+    for line in f_read:
 
-    while line != '':
-        line = f_read.readline()
+        # Inside a thing: copy lines through and index its node ids
+        if current_file is not None:
+            current_file.write(line)
+            m = NODE_ID.search(line)
+            if m:
+                node_to_thing[int(m.group(1))] = len(paths_to_write) - 1
+            if '</thing>' in line:
+                current_file.close()
+                current_file = None
+            continue
 
         # Check for flag activation
         if '<parameters>' in line:
             parameters_flag = True
-        elif '<thing' in line and '<things>' not in line:
-            thing_flag = True
-            name = re.match('(.*?)name=\"(.*?)\"', line)
-
-            name = name.groups()[-1]
-            files_to_write.append(open(os.path.dirname(nml_path) + '/' + name + '.nml', 'w'))
-            nodes_in_thing.append(0)
-            number_of_skeletons += 1
-            for parameters_line in parameters_lines:
-                files_to_write[number_of_skeletons-1].write(parameters_line)
+        elif THING_START.search(line):
+            paths_to_write.append(output_path(nml_path, line, len(paths_to_write) + 1, prefixed))
+            comments.append([])
+            branchpoints.append([])
+            current_file = open(paths_to_write[-1], 'w')
+            current_file.writelines(parameters_lines)
+            current_file.write(line)
+            if '</thing>' in line or line.rstrip().endswith('/>'):
+                current_file.close()
+                current_file = None
+            continue
         elif '<comments>' in line:
             comments_flag = True
+        elif '<branchpoints>' in line:
+            branchpoints_flag = True
 
-        # Count nodes in each thing
-        if '</node>' in line:
-            nodes_in_thing[number_of_skeletons-1] += 1
-
-        # Record parameter lines
+        # Record parameter lines, route comments and branchpoints by node id
         if parameters_flag:
             parameters_lines.append(line)
-        if thing_flag:
-            files_to_write[number_of_skeletons-1].write(line)
-        if comments_flag and '<comments>' not in line and '</comments>' not in line:
-            m = re.match('[ ]+<comment node="([1-9a-zA-z]+)" content="([1-9a-zA-z]+)"/>', line)
-            if m:
-                comment_nodes.append(int(m.group(1)))
-                comments.append(m.group(2))
+        elif comments_flag:
+            route(COMMENT_NODE.search(line), line, node_to_thing, comments)
+        elif branchpoints_flag:
+            route(BRANCHPOINT_ID.search(line), line, node_to_thing, branchpoints)
 
         # Check for flag deactivation
         if '</parameters>' in line:
             parameters_flag = False
-        elif '</thing>' in line:
-            thing_flag = False
         elif '</comments>' in line:
             comments_flag = False
-            i = 0
-            node_min = 1
-            node_max = 1
-            for file_to_write in files_to_write:
-                current_file = file_to_write
-                current_file.write('  <branchpoints>\n  </branchpoints>\n  <comments>\n')
-
-                node_max += nodes_in_thing[i]
-                j = 0
-                for comment_node in comment_nodes:
-                    if node_min < comment_node <= node_max:
-                        current_file.write('  <comment node="' + str(comment_node) + '" content="' + comments[j] + '"/>\n')
-                    j += 1
-
-                current_file.write('  </comments>\n</things>')
-                node_min += nodes_in_thing[i]
-                i += 1
+        elif '</branchpoints>' in line:
+            branchpoints_flag = False
+    f_read.close()
+    count('things_written', len(paths_to_write))
+    count('nodes_parsed', len(node_to_thing))
+
+    with stage('write_annotations'):
+        for i, path in enumerate(paths_to_write):
+            f = open(path, 'a')
+            f.write('  <branchpoints>\n')
+            f.writelines(branchpoints[i])
+            f.write('  </branchpoints>\n  <comments>\n')
+            f.writelines(comments[i])
+            f.write('  </comments>\n</things>\n')
+            f.close()
+
+def route(match, line, node_to_thing, lines_by_thing):
+    if match:
+        thing = node_to_thing.get(int(match.group(1)))
+        if thing is not None:
+            lines_by_thing[thing].append(line)
+
+# things are named after their name attribute, after the input's name when
+# prefixed, or numbered when they have none
+def output_path(nml_path, line, number, prefixed=False):
+    name = THING_NAME.search(line)
+    if name and prefixed:
+        return nml_path[:-4] + '_' + name.group(1) + '.nml'
+    if name:
+        return os.path.join(os.path.dirname(nml_path), name.group(1) + '.nml')
+    return nml_path[:-4] + '_' + str(number) + '.nml'
 
 
 if __name__ == "__main__":
+    workers = pop_workers(sys.argv)
     if len(sys.argv) != 2:
         print('\nNML_SPLITTER -- Written by Nathan Spencer 2016')
-        print('Usage: python nml_splitter.py ["path/to/nml/file.nml" || "path/to/nml/folder"]')
+        print('Usage: python nml_splitter.py ["path/to/nml/file.nml" || "path/to/nml/folder"] [-j workers]')
     else:
-        split_nmls(sys.argv[1])
+        split_nmls(sys.argv[1], workers)
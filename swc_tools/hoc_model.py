@@ -0,0 +1,104 @@
+import os
+import re
+import sys
+import numpy as np
+from topology import TopologyIndex
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common_tools'))
+from instrument import count
+
+# one pt3dadd line as swc2hoc writes it
+POINT_FORMAT = '  pt3dadd(%.3f, %.3f, %.3f, %s)'
+
+# section lists declared at the top of every file
+SECTION_LISTS = ('soma', 'dendrite')
+
+NUMBER = r'([-+0-9.eE]+)'
+PT3DADD = re.compile(r'pt3dadd\(\s*' + r'\s*,\s*'.join([NUMBER] * 4) + r'\s*\)')
+
+# the sections of a hoc file as arrays, indexed by section number
+class HocModel(object):
+
+    def __init__(self, parents, lists, offsets, points, order=None, labels=None):
+        # section each one connects to (-1 for none) and the section list
+        # it is appended to
+        self.parents = np.asarray(parents, dtype=np.int64)
+        self.lists = list(lists)
+        # x, y, z, diameter rows of section i are points[offsets[i]:offsets[i + 1]]
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 4)
+        # section numbers in the order they are written, and an optional
+        # comment line per section
+        self.order = np.arange(len(self.parents)) if order is None else np.asarray(order, dtype=np.int64)
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.parents)
+
+    def section_points(self, i):
+        return self.points[self.offsets[i]:self.offsets[i + 1]]
+
+    def copy(self, order=None, labels=None):
+        return HocModel(self.parents, self.lists, self.offsets, self.points,
+                        self.order if order is None else order, self.labels if labels is None else labels)
+
+    # same sections with the first kept in place and the rest grouped by the
+    # section they connect to, keeping their order within a group
+    def reordered(self):
+        rest = self.order[1:]
+        rest = rest[np.argsort(self.parents[rest], kind='stable')]
+        return self.copy(order=np.concatenate((self.order[:1], rest)))
+
+    # labels every section by branch order from the first one, e.g. d2,1,3
+    # is the third child of the first child of the second section leaving
+    # it; children are ranked by section number, one level at a time
+    def labelled(self):
+        topology = TopologyIndex(self.parents)
+        indptr, children = topology.children_indptr, topology.children
+        rank = np.zeros(len(self), dtype=np.int64)
+        rank[children] = np.arange(len(children)) - indptr[self.parents[children]] + 1
+
+        first = self.order[0] if len(self) else 0
+        path = np.full(len(self), None, dtype=object)
+        path[first] = ''
+        for level in topology.levels[1:]:
+            level = level[topology.root_of[level] == first]
+            above = path[self.parents[level]]
+            joiner = np.where(self.parents[level] == first, '', ',').astype(object)
+            path[level] = above + joiner + np.array([str(r) for r in rank[level].tolist()], dtype=object)
+
+        labels = [None if p is None else 'd' + p for p in path.tolist()]
+        if len(self):
+            labels[first] = self.lists[first]
+        return self.copy(labels=labels)
+
+    # writes every section in order; the text around the points is built per
+    # section and all points are formatted in one operation
+    def text(self, point_format=POINT_FORMAT):
+        pieces = [''.join('objref %s\n%s = new SectionList()\n' % (name, name) for name in SECTION_LISTS) + '\n']
+        point_line = point_format + '\n'
+        counts = np.diff(self.offsets)
+        for k, i in enumerate(self.order.tolist()):
+            if k:
+                pieces.append('\n')
+            if self.labels and self.labels[i] is not None:
+                pieces.append('// ' + self.labels[i].replace('%', '%%') + '\n')
+            if k == 0:
+                pieces.append('create sections[%d]\n' % len(self))
+            pieces.append('access sections[%d]\n%s.append()\n' % (i, self.lists[i]))
+            if self.parents[i] != -1:
+                pieces.append('connect sections[%d](0), sections[%d](1)\n' % (i, self.parents[i]))
+            pieces.append('sections[%d] {\n' % i + point_line * int(counts[i]) + '}\n')
+
+        # point rows of the sections in write order
+        counts = counts[self.order]
+        skip = np.repeat(self.offsets[self.order] - (np.cumsum(counts) - counts), counts)
+        rows = skip + np.arange(len(skip))
+        return ''.join(pieces) % tuple(self.points[rows].ravel().tolist())
+
+def write_hoc(model, hoc_path, point_format=POINT_FORMAT):
+    text = model.text(point_format)
+    with open(hoc_path, 'w') as f:
+        f.write(text)
+    count('sections_written', len(model))
+    count('bytes_written', len(text))
@@ -0,0 +1,106 @@
+import os
+import sys
+import json
+import struct
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common_tools'))
+from instrument import count
+
+# binary exports of node clouds and meshes; every array is converted to its
+# on-disk dtype once and written straight from its buffer
+
+PLY_TYPES = {'f4': 'float', 'i4': 'int', 'u1': 'uchar'}
+
+def ply_properties(dtype):
+    return ''.join('property %s %s\n' % (PLY_TYPES[dtype[name].str[1:]], name) for name in dtype.names)
+
+# little endian binary ply: vertices (V, 3) with optional named per-vertex
+# columns (e.g. radius, type), optional triangles (F, 3) and edges (E, 2)
+def write_ply(ply_path, vertices, columns=(), faces=None, edges=None):
+    vertex_dtype = np.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4')] +
+                            [(name, '<i4' if np.issubdtype(values.dtype, np.integer) else '<f4')
+                             for name, values in columns])
+    vertex_data = np.empty(len(vertices), dtype=vertex_dtype)
+    vertex_data['x'], vertex_data['y'], vertex_data['z'] = vertices.T
+    for name, values in columns:
+        vertex_data[name] = values
+
+    header = 'ply\nformat binary_little_endian 1.0\n'
+    header += 'element vertex %d\n' % len(vertices) + ply_properties(vertex_dtype)
+    elements = [vertex_data]
+    if faces is not None:
+        face_data = np.empty(len(faces), dtype=[('count', 'u1'), ('vertex_indices', '<i4', (3,))])
+        face_data['count'] = 3
+        face_data['vertex_indices'] = faces
+        header += 'element face %d\nproperty list uchar int vertex_indices\n' % len(faces)
+        elements.append(face_data)
+    if edges is not None:
+        edge_data = np.empty(len(edges), dtype=[('vertex1', '<i4'), ('vertex2', '<i4')])
+        edge_data['vertex1'], edge_data['vertex2'] = np.asarray(edges).T
+        header += 'element edge %d\n' % len(edges) + ply_properties(edge_data.dtype)
+        elements.append(edge_data)
+    header += 'end_header\n'
+
+    with open(ply_path, 'wb') as f:
+        f.write(header.encode('ascii'))
+        for data in elements:
+            data.tofile(f)
+        count('vertices_written', len(vertices))
+        count('bytes_written', f.tell())
+
+# gltf component types and the accessor type of each column width
+GL_FLOAT = 5126
+GL_UNSIGNED_INT = 5125
+GL_POINTS, GL_LINES, GL_TRIANGLES = 0, 1, 4
+ACCESSOR_TYPES = {1: 'SCALAR', 2: 'VEC2', 3: 'VEC3'}
+
+# binary gltf 2.0 with one mesh: vertices (V, 3) with optional named float
+# columns stored as custom _NAME attributes, drawn as triangles when faces
+# are given, otherwise as lines when edges are given, otherwise as points
+def write_glb(glb_path, vertices, columns=(), faces=None, edges=None):
+    arrays = [np.ascontiguousarray(vertices, dtype='<f4')]
+    arrays += [np.ascontiguousarray(values, dtype='<f4') for _, values in columns]
+    attributes = {'POSITION': 0}
+    for i, (name, _) in enumerate(columns, 1):
+        attributes['_' + name.upper()] = i
+    primitive = {'attributes': attributes, 'mode': GL_POINTS}
+    for indices, mode in ((faces, GL_TRIANGLES), (edges, GL_LINES)):
+        if indices is not None:
+            primitive['indices'] = len(arrays)
+            primitive['mode'] = mode
+            arrays.append(np.ascontiguousarray(indices, dtype='<u4').ravel())
+            break
+
+    buffer_views, accessors = [], []
+    offset = 0
+    for i, array in enumerate(arrays):
+        buffer_views.append({'buffer': 0, 'byteOffset': offset, 'byteLength': array.nbytes})
+        accessor = {'bufferView': i, 'componentType': GL_FLOAT if array.dtype.kind == 'f' else GL_UNSIGNED_INT,
+                    'count': len(array), 'type': ACCESSOR_TYPES[array.shape[1] if array.ndim > 1 else 1]}
+        if i == 0 and len(array):
+            accessor['min'] = array.min(axis=0).tolist()
+            accessor['max'] = array.max(axis=0).tolist()
+        accessors.append(accessor)
+        # every view starts on a 4 byte boundary
+        offset += array.nbytes + (-array.nbytes) % 4
+
+    gltf = {'asset': {'version': '2.0', 'generator': 'webknossos_toolkit'},
+            'scene': 0, 'scenes': [{'nodes': [0]}], 'nodes': [{'mesh': 0}],
+            'meshes': [{'primitives': [primitive]}],
+            'buffers': [{'byteLength': offset}], 'bufferViews': buffer_views, 'accessors': accessors}
+    text = json.dumps(gltf, separators=(',', ':')).encode('utf-8')
+    text += b' ' * ((-len(text)) % 4)
+
+    with open(glb_path, 'wb') as f:
+        f.write(struct.pack('<III', 0x46546C67, 2, 12 + 8 + len(text) + 8 + offset))
+        f.write(struct.pack('<II', len(text), 0x4E4F534A))
+        f.write(text)
+        f.write(struct.pack('<II', offset, 0x004E4942))
+        for array in arrays:
+            array.tofile(f)
+            f.write(b'\0' * ((-array.nbytes) % 4))
+        count('vertices_written', len(vertices))
+        count('bytes_written', f.tell())
+
+EXPORTERS = {'ply': write_ply, 'glb': write_glb}
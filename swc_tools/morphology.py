@@ -0,0 +1,214 @@
+import os
+import sys
+import json
+import hashlib
+import warnings
+import numpy as np
+from topology import TopologyIndex
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common_tools'))
+from instrument import count, enabled
+
+# one swc line: id type x y z radius parent; ten significant digits write
+# back the values of any swc read without rounding them
+SWC_FORMAT = '%d %d %.10g %.10g %.10g %.10g %d'
+
+# rows formatted per write call when saving large morphologies
+WRITE_CHUNK = 65536
+
+# binary sidecars live in a hidden folder next to the swc they were parsed from
+CACHE_DIR = '.swc_cache'
+NODE_DTYPE = np.dtype([('id', '<i8'), ('type', '<i8'), ('xyz', '<f8', (3,)),
+                       ('radius', '<f8'), ('parent', '<i8')])
+
+class Morphology(object):
+
+    def __init__(self, ids, types, xyz, radii, parents):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.types = np.asarray(types, dtype=np.int64)
+        self.xyz = np.asarray(xyz, dtype=np.float64).reshape(-1, 3)
+        self.radii = np.asarray(radii, dtype=np.float64)
+        self.parents = np.asarray(parents, dtype=np.int64)
+        self.topology_cache = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def copy(self):
+        return Morphology(self.ids.copy(), self.types.copy(), self.xyz.copy(),
+                          self.radii.copy(), self.parents.copy())
+
+    # new morphology holding only the given rows, ids are left untouched
+    def subset(self, rows):
+        return Morphology(self.ids[rows], self.types[rows], self.xyz[rows],
+                          self.radii[rows], self.parents[rows])
+
+    # true when ids are exactly 1..N in file order, as produced by swc_corrector
+    def is_consecutive(self):
+        n = len(self.ids)
+        return n == 0 or (self.ids[0] == 1 and self.ids[-1] == n and
+                          bool(np.all(np.diff(self.ids) == 1)))
+
+    # maps node ids to row indices, ids that are not present map to -1
+    def rows_of(self, node_ids):
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        if len(self.ids) == 0:
+            return np.full(node_ids.shape, -1, dtype=np.int64)
+        if self.is_consecutive():
+            rows = node_ids - 1
+            return np.where((rows >= 0) & (rows < len(self.ids)), rows, -1)
+        order = np.argsort(self.ids, kind='stable')
+        sorted_ids = self.ids[order]
+        pos = np.minimum(np.searchsorted(sorted_ids, node_ids), len(sorted_ids) - 1)
+        return np.where(sorted_ids[pos] == node_ids, order[pos], -1)
+
+    # row index of each node's parent; roots and dangling parents give -1
+    def parent_rows(self):
+        rows = self.rows_of(self.parents)
+        rows[self.parents == -1] = -1
+        return rows
+
+    def roots(self):
+        return self.topology().roots
+
+    # tree structure shared by every tool working on this morphology; rebuilt
+    # when ids or parents are replaced, call invalidate_topology after
+    # editing either of them in place
+    def topology(self):
+        # the arrays themselves are kept and compared by identity, an id()
+        # could be reused by a new array once the old one is freed
+        cache = self.topology_cache
+        if cache is None or cache[0] is not self.ids or cache[1] is not self.parents:
+            self.topology_cache = (self.ids, self.parents, TopologyIndex(self.parent_rows()))
+        return self.topology_cache[2]
+
+    def invalidate_topology(self):
+        self.topology_cache = None
+
+    # copy with ids renumbered to 1..N in row order, nodes that reference
+    # themselves or a missing node as parent become roots
+    def renumbered(self):
+        parent_rows = self.parent_rows()
+        rows = np.arange(len(self.ids), dtype=np.int64)
+        new_parents = np.where((parent_rows == -1) | (parent_rows == rows), -1, parent_rows + 1)
+        return Morphology(rows + 1, self.types.copy(), self.xyz.copy(),
+                          self.radii.copy(), new_parents)
+
+# formats every row of the given columns with fmt in one string operation
+def format_rows(fmt, columns):
+    if len(columns[0]) == 0:
+        return ''
+    values = [np.asarray(column).tolist() for column in columns]
+    return ((fmt + '\n') * len(values[0])) % tuple(v for row in zip(*values) for v in row)
+
+# parses an swc file into columnar arrays, skipping comments and blank lines
+def parse_swc(swc_path):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        data = np.loadtxt(swc_path, comments='#', usecols=range(7), ndmin=2)
+    if data.size == 0:
+        data = np.empty((0, 7))
+    if enabled():
+        count('bytes_read', os.path.getsize(swc_path))
+    count('nodes_parsed', len(data))
+    return Morphology(data[:, 0], data[:, 1], data[:, 2:5], data[:, 5], data[:, 6])
+
+# loads an swc, reusing its binary sidecar when the source is unchanged;
+# the sidecar is memory mapped copy-on-write so tools may edit arrays in place
+def load_swc(swc_path, cache=True):
+    if not cache:
+        return parse_swc(swc_path)
+
+    npy_path, stamp_path = sidecar_paths(swc_path)
+    stat = os.stat(swc_path)
+    stamp = read_stamp(stamp_path)
+    if stamp is not None and os.path.exists(npy_path) and stamp['size'] == stat.st_size:
+        fresh = stamp['mtime_ns'] == stat.st_mtime_ns
+        if not fresh and stamp['sha1'] == file_sha1(swc_path):
+            # touched or copied but identical content, refresh the stamp only
+            stamp['mtime_ns'] = stat.st_mtime_ns
+            write_stamp(stamp_path, stamp)
+            fresh = True
+        if fresh:
+            records = np.load(npy_path, mmap_mode='c')
+            count('sidecar_nodes', len(records))
+            return from_records(records)
+
+    morphology = parse_swc(swc_path)
+    try:
+        write_sidecar(morphology, npy_path, stamp_path,
+                      {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': file_sha1(swc_path)})
+    except (IOError, OSError):
+        # read-only folders simply go without a sidecar
+        pass
+    return morphology
+
+def sidecar_paths(swc_path):
+    folder, name = os.path.split(os.path.abspath(swc_path))
+    base = os.path.join(folder, CACHE_DIR, name)
+    return base + '.npy', base + '.json'
+
+def file_sha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def read_stamp(stamp_path):
+    try:
+        with open(stamp_path, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+def write_stamp(stamp_path, stamp):
+    tmp_path = '%s.%d.tmp' % (stamp_path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(stamp, f)
+    os.replace(tmp_path, stamp_path)
+
+# writes through temporary names so concurrent runs never see half a sidecar
+def write_sidecar(morphology, npy_path, stamp_path, stamp):
+    folder = os.path.dirname(npy_path)
+    if not os.path.isdir(folder):
+        os.makedirs(folder, exist_ok=True)
+    tmp_path = '%s.%d.tmp' % (npy_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        np.save(f, to_records(morphology))
+    os.replace(tmp_path, npy_path)
+    write_stamp(stamp_path, stamp)
+
+def to_records(morphology):
+    records = np.empty(len(morphology), dtype=NODE_DTYPE)
+    records['id'] = morphology.ids
+    records['type'] = morphology.types
+    records['xyz'] = morphology.xyz
+    records['radius'] = morphology.radii
+    records['parent'] = morphology.parents
+    return records
+
+# wraps node records as a morphology without copying the columns
+def from_records(records):
+    return Morphology(records['id'], records['type'], records['xyz'],
+                      records['radius'], records['parent'])
+
+def write_swc_rows(f, morphology, fmt=SWC_FORMAT):
+    m = morphology
+    for start in range(0, len(m), WRITE_CHUNK):
+        stop = start + WRITE_CHUNK
+        f.write(format_rows(fmt, (m.ids[start:stop], m.types[start:stop],
+                                  m.xyz[start:stop, 0], m.xyz[start:stop, 1], m.xyz[start:stop, 2],
+                                  m.radii[start:stop], m.parents[start:stop])))
+
+# writes the rows of a 2d array with fmt, WRITE_CHUNK rows per write call
+def write_table(f, fmt, table):
+    for start in range(0, len(table), WRITE_CHUNK):
+        f.write(format_rows(fmt, table[start:start + WRITE_CHUNK].T))
+
+def save_swc(morphology, swc_path, fmt=SWC_FORMAT):
+    with open(swc_path, 'w') as f:
+        write_swc_rows(f, morphology, fmt)
+        count('nodes_written', len(morphology))
+        if enabled():
+            count('bytes_written', f.tell())
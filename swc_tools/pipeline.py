@@ -0,0 +1,197 @@
+import os
+import sys
+import numpy as np
+from morphology import load_swc, save_swc, from_records
+from swc_binary import SWCB_EXTENSION, is_swcb, open_swcb, save_swcb
+from transform import parse_steps, apply_steps
+from swc_components import label_components
+from swc_cyclebreaker import without_cycles
+from swc_smoother import SMOOTHING_MODES, smooth_radii
+from swc2hoc import convert_morphology
+from swc2obj import OBJ_MODES, OBJ_FORMATS, export_morphology
+from swc2pt3dadd import write_pt3dadd
+from tube_mesh import SEGMENTS
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'nml_tools'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common_tools'))
+from nml2swc import nml_to_morphology
+from batch import pop_option
+from instrument import stage
+
+# chains of tools on one morphology held in memory: the input is read once,
+# each stage works on what the stage before it returned, and only the last
+# stage writes a file. Stages are separated by a lone "+" on the command line
+
+SEPARATOR = '+'
+
+# stages that change the morphology: name -> function(morphology, args)
+# returning the new morphology
+
+def center_stage(morphology, args):
+    apply_steps(morphology, [('center', ())])
+    return morphology
+
+def offset_stage(morphology, args):
+    apply_steps(morphology, [('translate', tuple(float(v) for v in args))])
+    return morphology
+
+def transform_stage(morphology, args):
+    apply_steps(morphology, parse_steps(args))
+    return morphology
+
+def correct_stage(morphology, args):
+    return morphology.renumbered()
+
+def cyclebreak_stage(morphology, args):
+    return without_cycles(morphology)[0]
+
+def components_stage(morphology, args):
+    return label_components(morphology)
+
+def smooth_stage(morphology, args):
+    mode = args[1] if len(args) > 1 else 'down'
+    morphology.radii = smooth_radii(morphology, float(args[0]), mode, int(args[2]) if len(args) > 2 else 5)
+    return morphology
+
+# (function, smallest and largest argument count), under the tool names and
+# shorter ones
+FILTERS = {
+    'center': (center_stage, 0, 0),
+    'offset': (offset_stage, 3, 3),
+    'transform': (transform_stage, 1, None),
+    'correct': (correct_stage, 0, 0),
+    'cyclebreak': (cyclebreak_stage, 0, 0),
+    'components': (components_stage, 0, 0),
+    'smooth': (smooth_stage, 1, 3),
+}
+ALIASES = {'swc_center': 'center', 'swc_offset': 'offset', 'swc_corrector': 'correct',
+           'swc_cyclebreaker': 'cyclebreak', 'swc_components': 'components', 'swc_smoother': 'smooth',
+           'hoc': 'swc2hoc', 'obj': 'swc2obj', 'pt3dadd': 'swc2pt3dadd'}
+
+# stages that write the result, one of which may end a pipeline: name ->
+# (function(morphology, args, out_path), output extension for the args)
+
+def swc_sink(morphology, args, out_path):
+    save_swc(morphology, out_path)
+
+def swcb_sink(morphology, args, out_path):
+    save_swcb(morphology, out_path)
+
+def hoc_sink(morphology, args, out_path):
+    convert_morphology(morphology, load_swc(args[0]), out_path)
+
+def obj_sink(morphology, args, out_path):
+    args = list(args)
+    fmt = pop_option(args, ('-f', '--format')) or 'obj'
+    export_morphology(morphology, out_path, args[0] if args else 'points',
+                      int(args[1]) if len(args) > 1 else SEGMENTS, fmt)
+
+def pt3dadd_sink(morphology, args, out_path):
+    write_pt3dadd(morphology, out_path)
+
+def obj_extension(args):
+    args = list(args)
+    return pop_option(args, ('-f', '--format')) or 'obj'
+
+SINKS = {
+    'swc': (swc_sink, lambda args: 'swc'),
+    'swcb': (swcb_sink, lambda args: SWCB_EXTENSION[1:]),
+    'swc2hoc': (hoc_sink, lambda args: 'hoc'),
+    'swc2obj': (obj_sink, obj_extension),
+    'swc2pt3dadd': (pt3dadd_sink, lambda args: 'txt'),
+}
+
+def split_stages(tokens):
+    stages = [[]]
+    for token in tokens:
+        if token == SEPARATOR:
+            stages.append([])
+        else:
+            stages[-1].append(token)
+    return [(ALIASES.get(stage[0], stage[0]), stage[1:]) for stage in stages if stage]
+
+# checks every stage before anything runs, so a typo in the last stage does
+# not cost a full run
+def check_stages(stages):
+    for i, (name, args) in enumerate(stages):
+        if name in SINKS:
+            if i != len(stages) - 1:
+                raise ValueError(name + ' writes the result and can only be the last stage')
+            if name == 'swc2hoc' and len(args) != 1:
+                raise ValueError('swc2hoc takes the soma skeleton: swc2hoc path/to/soma.swc')
+            if name == 'swc2obj':
+                args = list(args)
+                fmt = pop_option(args, ('-f', '--format')) or 'obj'
+                if fmt not in OBJ_FORMATS or (args and args[0] not in OBJ_MODES) or len(args) > 2:
+                    raise ValueError('swc2obj takes [points || tube] [ring segments] [-f obj || ply || glb]')
+        elif name == 'nml2swc':
+            if i != 0 or len(args) > 1:
+                raise ValueError('nml2swc can only be the first stage and takes an optional radius')
+        elif name in FILTERS:
+            lowest, highest = FILTERS[name][1:]
+            if len(args) < lowest or (highest is not None and len(args) > highest):
+                raise ValueError(name + ' takes ' + (str(lowest) if lowest == highest else
+                                 'at least ' + str(lowest)) + ' argument(s)')
+            if name == 'smooth' and float(args[0]) < 1:
+                raise ValueError('smooth takes a ratio of at least 1, e.g. smooth 1.1 for 10% per node')
+            if name == 'smooth' and len(args) > 1 and args[1] not in SMOOTHING_MODES:
+                raise ValueError('smooth mode must be one of ' + ', '.join(SMOOTHING_MODES))
+            if name == 'transform':
+                parse_steps(args)
+        else:
+            raise ValueError('unknown stage "' + name + '", expected one of ' +
+                             ', '.join(sorted(set(FILTERS) | set(SINKS) | set(['nml2swc']))))
+
+# .nml inputs are converted like nml2swc does, with the radius of a leading
+# nml2swc stage
+def load_input(path, stages):
+    if path.endswith('.nml'):
+        radius = stages[0][1][0] if stages and stages[0][0] == 'nml2swc' and stages[0][1] else 0
+        return nml_to_morphology(path, radius)
+    if is_swcb(path):
+        return from_records(np.array(open_swcb(path)))
+    return load_swc(path)
+
+# the output keeps the input's name with the extension of the last stage,
+# unless that would overwrite the input
+def output_path(in_path, extension):
+    stem = os.path.splitext(in_path)[0]
+    out_path = stem + '.' + extension
+    return out_path if os.path.abspath(out_path) != os.path.abspath(in_path) else stem + '_pipeline.' + extension
+
+# runs the stages on in_path and returns the path written; without a final
+# writing stage the result is saved as .swc
+def run_pipeline(in_path, tokens, out_path=None):
+    stages = split_stages(tokens)
+    check_stages(stages)
+    if not stages or stages[-1][0] not in SINKS:
+        stages.append(('swc', []))
+    sink, extension = SINKS[stages[-1][0]]
+    out_path = out_path or output_path(in_path, extension(stages[-1][1]))
+
+    with stage('load'):
+        morphology = load_input(in_path, stages)
+    for name, args in stages[:-1]:
+        if name != 'nml2swc':
+            with stage(name):
+                morphology = FILTERS[name][0](morphology, args)
+    with stage(stages[-1][0]):
+        sink(morphology, stages[-1][1], out_path)
+    return out_path
+
+if __name__ == "__main__":
+    out_path = pop_option(sys.argv, ('-o', '--output'))
+    if len(sys.argv) < 2:
+        print('\nPIPELINE -- run several tools on one skeleton in memory')
+        print('Usage: python pipeline.py ["path/to/file.nml" || ".swc" || ".swcb"] [stage] [args] + [stage] [args] ... [-o output]')
+        print('Stages: nml2swc [radius], center, offset dx dy dz, transform [steps], correct, cyclebreak, components,')
+        print('        smooth ratio [mode] [window], then optionally one of swc, swcb, swc2hoc soma.swc,')
+        print('        swc2obj [points || tube] [segments] [-f format], swc2pt3dadd')
+        print('Example: python pipeline.py cell.nml nml2swc + center + smooth 1.1 + swc2hoc soma.swc')
+    else:
+        try:
+            check_stages(split_stages(sys.argv[2:]))
+        except ValueError as e:
+            print('\nERROR -- ' + str(e))
+            sys.exit(1)
+        print(run_pipeline(sys.argv[1], sys.argv[2:], out_path))
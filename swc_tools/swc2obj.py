@@ -1,38 +1,79 @@
 import sys
 import glob
 import os
+import numpy as np
+from morphology import load_swc, format_rows, from_records
+from swc_binary import SWCB_EXTENSION, is_swcb, open_swcb, write_obj_swcb
+from tube_mesh import SEGMENTS, tube_mesh, write_obj_mesh
+from mesh_export import EXPORTERS
 
-def write_obj(swc_path):
-    swcs = []
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common_tools'))
+from batch import run_batch, manifest_for, pop_workers, pop_option
+from instrument import stage
+from output_cache import cache_for
+
+# point cloud of the nodes, or a tube surface around the edges
+OBJ_MODES = ('points', 'tube')
+
+# text obj, or binary ply and glb written straight from the arrays
+OBJ_FORMATS = ('obj',) + tuple(sorted(EXPORTERS))
+
+def write_obj(swc_path, workers=None, mode='points', segments=SEGMENTS, fmt='obj'):
     if os.path.isdir(swc_path):
         swcs = glob.glob(os.path.normpath(swc_path) + '/*.swc')
+        swcs += glob.glob(os.path.normpath(swc_path) + '/*' + SWCB_EXTENSION)
+        cache = cache_for(swc_path, 'swc2obj', (mode, segments, fmt), lambda swc: [mesh_path(swc, fmt)])
+        run_batch(convert_swc, swcs, (mode, segments, fmt), workers, manifest_for(swc_path, 'swc2obj'), cache)
     else:
-        swcs.append(swc_path)
-
-    for swc in swcs:
-        current_swc = open(swc, 'r')
-        lines = current_swc.readlines()
-        lines_to_write = []
-        current_swc.close()
+        convert_swc(swc_path, mode, segments, fmt)
 
-        for line in lines:
-            if not line.strip() or line[0] == '#':
-                continue
-            swc_components = line.split(' ')
-            lines_to_write.append('v ' + swc_components[2] + ' ' + swc_components[3] + \
-                ' ' + swc_components[4] + '\n')
+def mesh_path(swc, fmt):
+    return os.path.splitext(swc)[0] + '.' + fmt
 
-        obj = open(swc[:-3] + 'obj', 'w')
-
-        for line in lines_to_write:
-            obj.write(line)
+def convert_swc(swc, mode='points', segments=SEGMENTS, fmt='obj'):
+    obj_path = mesh_path(swc, fmt)
+    if mode == 'points' and fmt == 'obj' and is_swcb(swc):
+        with stage('write'):
+            write_obj_swcb(swc, obj_path)
+    else:
+        with stage('load'):
+            morphology = from_records(open_swcb(swc)) if is_swcb(swc) else load_swc(swc)
+        export_morphology(morphology, obj_path, mode, segments, fmt)
+    print(obj_path)
 
-        obj.close()
-        print(swc[:-3] + 'obj')
+# binary formats in points mode keep each node's radius and type and draw
+# the parent edges
+def export_morphology(morphology, out_path, mode='points', segments=SEGMENTS, fmt='obj'):
+    if mode == 'tube':
+        with stage('tube_mesh'):
+            vertices, faces = tube_mesh(morphology, segments)
+        with stage('write'):
+            if fmt == 'obj':
+                write_obj_mesh(out_path, vertices, faces)
+            else:
+                EXPORTERS[fmt](out_path, vertices, faces=faces)
+    elif fmt == 'obj':
+        with stage('write'):
+            x, y, z = morphology.xyz.T
+            obj = open(out_path, 'w')
+            obj.write(format_rows('v %.3f %.3f %.3f', (x, y, z)))
+            obj.close()
+    else:
+        parent_rows = morphology.parent_rows()
+        linked = np.flatnonzero(parent_rows != -1)
+        with stage('write'):
+            EXPORTERS[fmt](out_path, morphology.xyz, (('radius', morphology.radii), ('type', morphology.types)),
+                           edges=np.column_stack((linked, parent_rows[linked])))
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print('\nNML_MERGER -- Written by Nathan Spencer 2016')
-        print('Usage: python swc2obj.py ["path/to/nml/folder" || "path/tp/nml/file.nml"]')
+    workers = pop_workers(sys.argv)
+    fmt = pop_option(sys.argv, ('-f', '--format')) or 'obj'
+    if len(sys.argv) < 2 or len(sys.argv) > 4 or (len(sys.argv) > 2 and sys.argv[2] not in OBJ_MODES) or fmt not in OBJ_FORMATS:
+        print('\nSWC2OBJ -- Written by Nathan Spencer 2016')
+        print('Usage: python swc2obj.py ["path/to/swc/file.swc" || "path/to/swc/folder"] [points || tube] [ring segments] [-f obj || ply || glb] [-j workers]')
+    elif len(sys.argv) == 2:
+        write_obj(sys.argv[1], workers, fmt=fmt)
+    elif len(sys.argv) == 3:
+        write_obj(sys.argv[1], workers, sys.argv[2], fmt=fmt)
     else:
-        write_obj(sys.argv[1])
+        write_obj(sys.argv[1], workers, sys.argv[2], int(sys.argv[3]), fmt)
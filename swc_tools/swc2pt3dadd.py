@@ -1,37 +1,14 @@
 import sys
-
-def x_of(line):
-	return line.split()[2]
-
-def y_of(line):
-    return line.split()[3]
-
-def z_of(line):
-    return line.split()[4]
-
-def radius_of(line):
-    return line.split()[5]
+from morphology import load_swc, format_rows
 
 def pt3dadd(swc_path):
-    f = open(swc_path, 'r')
-    lines = f.readlines()
-    lines_to_write = []
-    f.close()
-
-    for line in lines:
-        line.strip()
-
-        x = x_of(line)
-        y = y_of(line)
-        z = z_of(line)
-        radius = radius_of(line)
+    write_pt3dadd(load_swc(swc_path), swc_path[:-4] + '_pt3dadd.txt')
 
-        line_to_write = '  pt3dadd(' + x + ', ' + y + ', ' + z + ', ' + radius + ')\n'
-        lines_to_write.append(line_to_write)
+def write_pt3dadd(morphology, txt_path):
+    x, y, z = morphology.xyz.T
 
-    f = open(swc_path[:-4] + '_pt3dadd.txt', 'w')
-    for line in lines_to_write:
-        f.write(line)
+    f = open(txt_path, 'w')
+    f.write(format_rows('  pt3dadd(%.3f, %.3f, %.3f, %.3f)', (x, y, z, morphology.radii)))
     f.close()
 
 if __name__ == "__main__":
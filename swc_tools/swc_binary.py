@@ -0,0 +1,108 @@
+import sys
+import itertools
+import numpy as np
+from numpy.lib.format import open_memmap
+from morphology import NODE_DTYPE, from_records, to_records, format_rows, write_swc_rows
+
+# .swcb is an .npy file of fixed-width node records (see NODE_DTYPE), so any
+# slice of it can be memory mapped without reading the rest of the file
+SWCB_EXTENSION = '.swcb'
+
+# nodes held in memory at once by the chunked operations below
+CHUNK = 1 << 20
+
+def is_swcb(path):
+    return path.endswith(SWCB_EXTENSION)
+
+def open_swcb(swcb_path, mode='r'):
+    return open_memmap(swcb_path, mode=mode)
+
+def create_swcb(swcb_path, n):
+    return open_memmap(swcb_path, mode='w+', dtype=NODE_DTYPE, shape=(n,))
+
+def save_swcb(morphology, swcb_path):
+    with open(swcb_path, 'wb') as f:
+        np.save(f, to_records(morphology))
+
+def chunks(n, size=CHUNK):
+    for start in range(0, n, size):
+        yield start, min(start + size, n)
+
+def node_lines(f):
+    for line in f:
+        stripped = line.strip()
+        if stripped and stripped[0] != '#':
+            yield stripped
+
+# converts swc text to .swcb in two streaming passes: count, then fill
+def swc2swcb(swc_path, swcb_path):
+    with open(swc_path, 'r') as f:
+        n = sum(1 for _ in node_lines(f))
+
+    out = create_swcb(swcb_path, n)
+    with open(swc_path, 'r') as f:
+        lines = node_lines(f)
+        for start, stop in chunks(n):
+            data = np.loadtxt(list(itertools.islice(lines, stop - start)), usecols=range(7), ndmin=2)
+            out['id'][start:stop] = data[:, 0]
+            out['type'][start:stop] = data[:, 1]
+            out['xyz'][start:stop] = data[:, 2:5]
+            out['radius'][start:stop] = data[:, 5]
+            out['parent'][start:stop] = data[:, 6]
+    out.flush()
+
+def swcb2swc(swcb_path, swc_path):
+    records = open_swcb(swcb_path)
+    with open(swc_path, 'w') as f:
+        for start, stop in chunks(len(records)):
+            write_swc_rows(f, from_records(records[start:stop]))
+
+# copies src to dst chunk by chunk, letting transform edit each output chunk
+def map_swcb(src_path, dst_path, transform):
+    src = open_swcb(src_path)
+    dst = create_swcb(dst_path, len(src))
+    for start, stop in chunks(len(src)):
+        dst[start:stop] = src[start:stop]
+        transform(dst[start:stop], start, stop)
+    dst.flush()
+
+def write_obj_swcb(swcb_path, obj_path):
+    records = open_swcb(swcb_path)
+    with open(obj_path, 'w') as f:
+        for start, stop in chunks(len(records)):
+            x, y, z = records['xyz'][start:stop].T
+            f.write(format_rows('v %.3f %.3f %.3f', (x, y, z)))
+
+# renumbers ids to 1..N like swc_corrector; parents are looked up by binary
+# search in the mapped id column, which needs ids in increasing order (as
+# written by nml2swc and nml_merger), otherwise a sorted copy is built
+def renumber_swcb(src_path, dst_path):
+    src = open_swcb(src_path)
+    ids = src['id']
+    order = None
+    for start, stop in chunks(len(src)):
+        lo = max(start - 1, 0)
+        if np.any(np.diff(ids[lo:stop]) <= 0):
+            order = np.argsort(ids, kind='stable')
+            ids = ids[order]
+            break
+
+    def renumber(chunk, start, stop):
+        rows = np.arange(start, stop)
+        parents = chunk['parent']
+        pos = np.minimum(np.searchsorted(ids, parents), max(len(ids) - 1, 0))
+        found = (ids[pos] == parents) & (parents != -1)
+        if order is not None:
+            pos = order[pos]
+        chunk['parent'] = np.where(found & (pos != rows), pos + 1, -1)
+        chunk['id'] = rows + 1
+    map_swcb(src_path, dst_path, renumber)
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print('\nSWC_BINARY -- convert between .swc and memory-mappable .swcb')
+        print('Usage: python swc_binary.py ["path/to/file.swc" || "path/to/file.swcb"]')
+    elif is_swcb(sys.argv[1]):
+        swcb2swc(sys.argv[1], sys.argv[1][:-5] + '.swc')
+    else:
+        swc2swcb(sys.argv[1], sys.argv[1][:-4] + SWCB_EXTENSION)
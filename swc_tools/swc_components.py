@@ -1,55 +1,65 @@
+import os
 import sys
+import numpy as np
+from morphology import load_swc, save_swc
 
-def components(swc_path):
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common_tools'))
+from instrument import stage
+
+class Components(object):
+
+	def __init__(self, labels, root_rows, root_ids, sizes, lower, upper):
+		# component number of each row, -1 for rows on or below a loop
+		self.labels = labels
+		# per component: row and swc id of its root, node count and bounding
+		# box corners
+		self.root_rows = root_rows
+		self.root_ids = root_ids
+		self.sizes = sizes
+		self.lower = lower
+		self.upper = upper
+
+	def __len__(self):
+		return len(self.root_rows)
 
-	f = open(swc_path, 'r')
-	lines = f.readlines()
-	f.close()
-
-	# make a map from parent to child, determine number of components
-	root_indices = []
-	parent_to_child = {}
-	index_to_type = {}
-
-	for line in lines:
-		parent = line.split()[0]
-
-		# check for a root node
-		if line.split()[6].strip() == '-1':
-			root_indices.append( line.split()[0] )
-
-		# look for some children
-		for sub_line in lines:
-			if sub_line.split()[6].strip() == parent:
-				if parent not in parent_to_child:
-					parent_to_child[ parent ] = []
-				parent_to_child[ parent ].append( sub_line.split()[0].strip() )
-
-	# dfs to set color of each connected component
-	for ii, _ in enumerate(root_indices):
-		dfs(ii, root_indices, index_to_type, parent_to_child)
-
-	f = open(swc_path[:-4] + '_components.swc', 'w')
-
-	for line in lines:
-		if line.split()[0] in index_to_type:
-			f.write(str(line.split()[0]) + ' ' + str(index_to_type[ line.split()[0] ]) + ' ' + str(line.split()[2]) + \
-				' ' + str(line.split()[3]) + ' ' + str(line.split()[4]) + ' ' + str(line.split()[5]) + \
-				' ' + str(line.split()[6].strip()) + '\n')
-	f.close()
-
-
-def dfs(index, root_indices, index_to_type, parent_to_child):
-	dfs_stack = []
-	current_index = root_indices[index]
-	dfs_stack.append(current_index)
-
-	while dfs_stack:
-		current_index = dfs_stack.pop()
-		index_to_type[current_index] = index;
-		if current_index in parent_to_child:
-			for j in parent_to_child[current_index]:
-				dfs_stack.append(j)
+# labels every node with the component of the root it hangs from, numbered in
+# file order of the roots; pointer jumping up the parent array finds each
+# node's root in O(log depth) vectorized passes
+def connected_components(morphology):
+	topology = morphology.topology()
+	roots = topology.roots
+	root_number = np.full(len(topology), -1, dtype=np.int64)
+	root_number[roots] = np.arange(len(roots))
+	labels = root_number[topology.root_of]
+
+	# loops never reach a root and so stay unlabelled
+	labelled = np.flatnonzero(labels != -1)
+	sizes = np.bincount(labels[labelled], minlength=len(roots))
+	lower = np.zeros((len(roots), 3))
+	upper = np.zeros((len(roots), 3))
+	if len(labelled):
+		order = labelled[np.argsort(labels[labelled], kind='stable')]
+		starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+		xyz = morphology.xyz[order]
+		lower = np.minimum.reduceat(xyz, starts, axis=0)
+		upper = np.maximum.reduceat(xyz, starts, axis=0)
+	return Components(labels, roots, morphology.ids[roots], sizes, lower, upper)
+
+# colors each connected component by its number, leaving out loops
+def label_components(morphology):
+	found = connected_components(morphology)
+	rows = np.flatnonzero(found.labels != -1)
+	result = morphology.subset(rows)
+	result.types = found.labels[rows]
+	return result
+
+def components(swc_path):
+	with stage('load'):
+		morphology = load_swc(swc_path)
+	with stage('components'):
+		result = label_components(morphology)
+	with stage('save_swc'):
+		save_swc(result, swc_path[:-4] + '_components.swc')
 
 
 if __name__ == "__main__":
@@ -1,74 +1,65 @@
+import os
 import sys
-import code
-
-def redraw(swc_path, adjacency_list, new_root):
-	f = open(swc_path, 'r')
-	lines = f.readlines()
-	f.close()
-
-	child_to_parent = {}
-	child_to_parent[new_root] = '-1'
-	discovered = []
-	discovered.append(new_root)
-	dfs_stack = []
-	dfs_stack.append(new_root)
-
-	while(dfs_stack):
-		current_index = dfs_stack.pop()
-		for i in adjacency_list[ current_index ]:
-			if i not in discovered:
-				discovered.append(i)
-				dfs_stack.append(i)
-				child_to_parent[i] = current_index
-
-	f = open(swc_path[:-4] + '_cyclebroken.swc', 'w')
-
-	code.interact(local=locals())
-
-	for line in lines:
-		f.write(index(line) + ' ' + line.split()[1] + ' ' + line.split()[2] + \
-			' ' + line.split()[3] + ' ' + line.split()[4] + ' ' + line.split()[5] + \
-			' ' + child_to_parent[index(line)] + '\n')
-
-	f.close()
-
-def adjacency_list(swc_path):
-	f = open(swc_path, 'r')
-	lines = f.readlines()
-	f.close()
-
-	adjacency_list = {}
-	for line in lines:
-		adjacency_list[index(line)] = []
-
-	for line in lines:
-		if (parent(line) != -1):
-			adjacency_list[ parent(line) ].append( index(line) )
-			adjacency_list[ index(line) ].append( parent(line) )
-
-	return adjacency_list
-
-def new_root(swc_path):
-	f = open(swc_path, 'r')
-	lines = f.readlines()
-	f.close()
-
-	# node with type 1 becomes new root
-	for line in lines:
-		if type_of(line) == '1':
-			return index(line)
-
-	# case where no root indicated by type
-	return '-1'
-
-def parent(line):
-	return line.split()[6].strip()
-
-def index(line):
-	return line.split()[0]
-
-def type_of(line):
-	return line.split()[1]
+import numpy as np
+from morphology import load_swc, save_swc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common_tools'))
+from instrument import stage
+
+# redraws the graph as a breadth first spanning forest: the first type 1 node
+# roots its component, every other component is rooted at its own root or,
+# if it is a loop without one, at its first node; returns the new parent row
+# of every node and the (child, parent) row pairs of the edges left out
+def break_cycles(morphology):
+	topology = morphology.topology()
+	parent_rows = topology.parent_rows
+	n = len(parent_rows)
+	# the neighbours of row i are indices[indptr[i]:indptr[i + 1]]
+	indptr, indices = topology.adjacency()
+	indptr, indices = indptr.tolist(), indices.tolist()
+
+	seeds = np.concatenate((np.flatnonzero(morphology.types == 1)[:1],
+	                        np.flatnonzero(parent_rows == -1), np.arange(n)))
+	new_parents = [-2] * n
+	for seed in seeds.tolist():
+		if new_parents[seed] != -2:
+			continue
+		new_parents[seed] = -1
+		queue = [seed]
+		for current in queue:
+			for i in indices[indptr[current]:indptr[current + 1]]:
+				if new_parents[i] == -2:
+					new_parents[i] = current
+					queue.append(i)
+	new_parents = np.array(new_parents, dtype=np.int64)
+
+	# an old edge survives if the forest uses it in either direction; when both
+	# directions were listed only the one pointing the new way survives
+	children = np.flatnonzero(parent_rows != -1)
+	old_parents = parent_rows[children]
+	forward = new_parents[children] == old_parents
+	backward = (new_parents[old_parents] == children) & (parent_rows[old_parents] != children)
+	removed = ~(forward | backward)
+	return new_parents, np.column_stack((children[removed], old_parents[removed]))
+
+# the morphology redrawn as that forest, and the (child, parent) ids of the
+# edges left out
+def without_cycles(morphology):
+	new_parents, removed = break_cycles(morphology)
+	result = morphology.copy()
+	result.parents = np.where(new_parents == -1, -1, morphology.ids[np.maximum(new_parents, 0)])
+	return result, morphology.ids[removed]
+
+def redraw(swc_path, morphology):
+	with stage('break_cycles'):
+		result, removed = without_cycles(morphology)
+
+	print('Removed ' + str(len(removed)) + ' edge(s):')
+	for child, parent in removed.tolist():
+		print('  ' + str(child) + ' -> ' + str(parent))
+
+	with stage('save_swc'):
+		save_swc(result, swc_path[:-4] + '_cyclebroken.swc')
 
 if __name__ == "__main__":
 	if len(sys.argv) != 2:
@@ -76,6 +67,6 @@ if __name__ == "__main__":
 		print('Usage: python swc_cyclebreaker.py ["path/to/swc/file.swc"]')
 	else:
 		swc_path = sys.argv[1]
-		root = new_root(swc_path)
-		adj = adjacency_list(swc_path)
-		redraw(swc_path, adj, root)
+		with stage('load'):
+			morphology = load_swc(swc_path)
+		redraw(swc_path, morphology)
@@ -0,0 +1,64 @@
+import numpy as np
+from topology import jump
+
+class SectionTable(object):
+
+    def __init__(self, starts, ends, offsets, nodes, branchpoints):
+        # row of the node each section starts from and ends at, sorted by end
+        self.starts = starts
+        self.ends = ends
+        # rows of section i, from just after its start down to its end, are
+        # nodes[offsets[i]:offsets[i + 1]]
+        self.offsets = offsets
+        self.nodes = nodes
+        self.branchpoints = branchpoints
+
+    def __len__(self):
+        return len(self.ends)
+
+    def rows(self, i):
+        return self.nodes[self.offsets[i]:self.offsets[i + 1]]
+
+    # index of the section each section hangs from (the one ending where it
+    # starts), -1 for sections that start at the root
+    def parent_sections(self, root):
+        parents = np.searchsorted(self.ends, self.starts)
+        parents = np.minimum(parents, max(len(self.ends) - 1, 0))
+        return np.where(self.starts == root, -1, parents)
+
+# splits the tree hanging from root into unbranched sections in O(N): a new
+# section ends at every branchpoint and every leaf, and the root always ends
+# a section of its own with no nodes; nodes not connected to the root are
+# ignored
+def decompose(topology, root):
+    parent_rows = topology.parent_rows
+    n = len(parent_rows)
+    rows = np.arange(n)
+
+    # keep only nodes whose topmost ancestor is the root; their children are
+    # all reachable too, so the index's child counts hold for them
+    reachable = topology.root_of == root
+    linked = reachable & (parent_rows != -1)
+
+    child_counts = topology.child_counts
+    is_end = reachable & (child_counts != 1)
+    is_end[root] = True
+    is_break = is_end
+    branchpoints = np.flatnonzero(reachable & (child_counts >= 2))
+
+    # walk down unbranched chains to the end of the section each node is in
+    only_child = np.full(n, -1, dtype=np.int64)
+    only_child[parent_rows[linked]] = rows[linked]
+    section_end, hops_to_end = jump(np.where(is_break | ~reachable, rows, only_child))
+
+    # and up to the break node each section starts from
+    first_break, _ = jump(np.where(is_break | ~reachable, rows, parent_rows))
+    ends = np.flatnonzero(is_end)
+    starts = np.where(ends == root, root, first_break[np.maximum(parent_rows[ends], 0)])
+
+    # group member nodes by section, deepest (closest to the start) first
+    members = np.flatnonzero(linked)
+    members = members[np.lexsort((-hops_to_end[members], section_end[members]))]
+    counts = np.bincount(np.searchsorted(ends, section_end[members]), minlength=len(ends))
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    return SectionTable(starts, ends, offsets, members, branchpoints)
@@ -1,57 +1,81 @@
+import os
 import sys
+import numpy as np
+from morphology import load_swc, save_swc
 
-def swc_smooth(swc_file, allowable_change):
-
-    f = open(swc_file, 'r')
-    lines = f.readlines()
-    f.close()
-    radii = {}
-    parents = {}
-    xs = {}
-    ys = {}
-    zs = {}
-    for line in lines:
-        radii[int(line.split(' ')[0])] = float(line.split(' ')[5].strip())
-        #print line.split(' ')[0]
-        parents[int(line.split(' ')[0])] = int(line.split(' ')[6].strip())
-        xs[int(line.split(' ')[0])] = float(line.split(' ')[2].strip())
-        ys[int(line.split(' ')[0])] = float(line.split(' ')[3].strip())
-        zs[int(line.split(' ')[0])] = float(line.split(' ')[4].strip())
-
-    count = 4
-    while count > 3:
-        count = 0
-        for each in radii.keys():
-            if parents[each] == -1:
-                continue
-
-            parent = parents[each]
-            radchild = radii[each]
-            raddad = radii[parent]
-            if raddad == 0 or radchild == 0:
-                continue
-            if ((radchild /raddad) > allowable_change):
-                radii[each] = raddad * allowable_change
-                count += 1
-            if (raddad/radchild) > allowable_change:
-                radii[each] = raddad / allowable_change
-                count += 1
-        print "count: "  + str(count)
-
-
-
-    f = open(swc_file[:-4] + '_smooth.swc', 'w')
-
-    for i in radii.keys():
-        print i
-        #code.interact(local=locals())
-        f.write(str(i) + ' 3 ' + str(xs[i]) + ' ' + str(ys[i]) + ' ' + str(zs[i]) + ' ' + \
-            str(radii[i]) + ' ' + str(parents[i]) + '\n')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common_tools'))
+from instrument import stage
+
+SMOOTHING_MODES = ('down', 'both', 'window')
+
+# caps the radius ratio between every node and its parent at allowable_change,
+# one vectorized step per depth level, parents always settled before children;
+# nodes or parents with radius 0 are left alone
+def clamp_down(radii, parent_rows, levels, allowable_change):
+    for level in levels[1:]:
+        parents = radii[parent_rows[level]]
+        capped = np.clip(radii[level], parents / allowable_change, parents * allowable_change)
+        radii[level] = np.where((parents == 0) | (radii[level] == 0), radii[level], capped)
+
+# pulls each parent into the range its children allow, deepest level first
+def clamp_up(radii, parent_rows, levels, allowable_change):
+    for level in reversed(levels[1:]):
+        level = level[radii[level] != 0]
+        parents, slot = np.unique(parent_rows[level], return_inverse=True)
+        lower = np.zeros(len(parents))
+        upper = np.full(len(parents), np.inf)
+        np.maximum.at(lower, slot, radii[level] / allowable_change)
+        np.minimum.at(upper, slot, radii[level] * allowable_change)
+        keep = radii[parents] != 0
+        parents, lower, upper = parents[keep], lower[keep], upper[keep]
+        radii[parents] = np.clip(radii[parents], np.minimum(lower, upper), upper)
+
+# mean radius of each node and up to window - 1 of its ancestors
+def window_mean(radii, parent_rows, window):
+    total = radii.copy()
+    count = np.ones(len(radii))
+    ancestor = parent_rows.copy()
+    for _ in range(window - 1):
+        present = ancestor != -1
+        total[present] += radii[ancestor[present]]
+        count[present] += 1
+        ancestor[present] = parent_rows[ancestor[present]]
+    return total / count
+
+# allowable_change is the largest ratio between a radius and its parent's,
+# e.g. 1.1 for 10%; below 1 no radius could satisfy it
+def smooth_radii(morphology, allowable_change, mode='down', window=5):
+    if allowable_change < 1:
+        raise ValueError('allowed change per node is a ratio of at least 1, e.g. 1.1 for 10%')
+    # levels[d] holds the rows at depth d; rows on or below a loop are left out
+    topology = morphology.topology()
+    parent_rows, levels = topology.parent_rows, topology.levels
+    radii = morphology.radii.copy()
+    if mode == 'window':
+        radii = np.where(radii == 0, 0, window_mean(radii, parent_rows, window))
+    elif mode == 'both':
+        clamp_up(radii, parent_rows, levels, allowable_change)
+    clamp_down(radii, parent_rows, levels, allowable_change)
+    return radii
+
+def swc_smooth(swc_file, allowable_change, mode='down', window=5):
+    with stage('load'):
+        morphology = load_swc(swc_file)
+    with stage('smooth'):
+        morphology.radii = smooth_radii(morphology, allowable_change, mode, window)
+    with stage('save_swc'):
+        save_swc(morphology, swc_file[:-4] + '_smooth.swc')
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
+    if (len(sys.argv) < 3 or len(sys.argv) > 5 or (len(sys.argv) > 3 and sys.argv[3] not in SMOOTHING_MODES)
+            or float(sys.argv[2]) < 1):
         print('SWC_SMOOTHER -- Written by Nathan Spencer 2016')
-        print('Usage: python swc_smoother.py [path/to/swc/file.swc] [allowed change per node (i.e. 1.5)]')
-    else:
+        print('Usage: python swc_smoother.py [path/to/swc/file.swc] [allowed change per node (i.e. 1.5)] [down || both || window] [window size]')
+        print('Note: the allowed change is a ratio of at least 1; 1.1 lets radii change by 10% per node')
+    elif len(sys.argv) == 3:
         swc_smooth(sys.argv[1], float(sys.argv[2]))
+    elif len(sys.argv) == 4:
+        swc_smooth(sys.argv[1], float(sys.argv[2]), sys.argv[3])
+    else:
+        swc_smooth(sys.argv[1], float(sys.argv[2]), sys.argv[3], int(sys.argv[4]))
@@ -0,0 +1,161 @@
+import numpy as np
+
+# follows pointers (row -> row, fixed points mark the end of a chain) until
+# every row points at the end of its chain, in O(log chain length) vectorized
+# passes; also returns the number of hops taken from each row to get there
+def jump(pointers, max_passes=64):
+    pointers = pointers.copy()
+    hops = (pointers != np.arange(len(pointers))).astype(np.int64)
+    for _ in range(max_passes):
+        further = pointers[pointers]
+        if np.array_equal(further, pointers):
+            break
+        hops += hops[pointers]
+        pointers = further
+    return pointers, hops
+
+# tree structure derived from a parent-row array (-1 for roots); every field
+# is computed on first use and kept, so tools sharing a morphology build each
+# one once. Rows on or below a loop have no root and are not "rooted".
+class TopologyIndex(object):
+
+    def __init__(self, parent_rows):
+        self.parent_rows = parent_rows
+        self.cache = {}
+
+    def __len__(self):
+        return len(self.parent_rows)
+
+    def cached(self, name, compute):
+        if name not in self.cache:
+            self.cache[name] = compute()
+        return self.cache[name]
+
+    @property
+    def roots(self):
+        return self.cached('roots', lambda: np.flatnonzero(self.parent_rows == -1))
+
+    # root row above every row, and the number of edges up to it
+    @property
+    def root_of(self):
+        return self.ancestry()[0]
+
+    @property
+    def depth(self):
+        return self.ancestry()[1]
+
+    def ancestry(self):
+        def compute():
+            rows = np.arange(len(self.parent_rows))
+            return jump(np.where(self.parent_rows == -1, rows, self.parent_rows))
+        return self.cached('ancestry', compute)
+
+    @property
+    def rooted(self):
+        return self.cached('rooted', lambda: self.parent_rows[self.root_of] == -1)
+
+    # children of row i are children[children_indptr[i]:children_indptr[i + 1]],
+    # in row order
+    @property
+    def children_indptr(self):
+        return self.children_csr()[0]
+
+    @property
+    def children(self):
+        return self.children_csr()[1]
+
+    def children_csr(self):
+        def compute():
+            linked = np.flatnonzero(self.parent_rows != -1)
+            parents = self.parent_rows[linked]
+            counts = np.bincount(parents, minlength=len(self.parent_rows))
+            return np.concatenate(([0], np.cumsum(counts))), linked[np.argsort(parents, kind='stable')]
+        return self.cached('children', compute)
+
+    @property
+    def child_counts(self):
+        return np.diff(self.children_indptr)
+
+    @property
+    def leaf_mask(self):
+        return self.child_counts == 0
+
+    @property
+    def branch_mask(self):
+        return self.child_counts >= 2
+
+    # undirected neighbours (parent and children) of every row in csr form
+    def adjacency(self):
+        def compute():
+            linked = np.flatnonzero(self.parent_rows != -1)
+            sources = np.concatenate((linked, self.parent_rows[linked]))
+            targets = np.concatenate((self.parent_rows[linked], linked))
+            counts = np.bincount(sources, minlength=len(self.parent_rows))
+            return np.concatenate(([0], np.cumsum(counts))), targets[np.argsort(sources, kind='stable')]
+        return self.cached('adjacency', compute)
+
+    # rooted rows grouped by depth; every parent sits one level above its children
+    @property
+    def levels(self):
+        def compute():
+            rooted = np.flatnonzero(self.rooted)
+            rooted = rooted[np.argsort(self.depth[rooted], kind='stable')]
+            bounds = np.concatenate(([0], np.cumsum(np.bincount(self.depth[rooted]))))
+            return [rooted[bounds[d]:bounds[d + 1]] for d in range(len(bounds) - 1)]
+        return self.cached('levels', compute)
+
+    # rooted rows, parents before children, level by level
+    @property
+    def order(self):
+        return self.cached('order', lambda: np.concatenate(self.levels) if self.levels else np.empty(0, dtype=np.int64))
+
+    # number of rows in the subtree of each row, itself included
+    @property
+    def subtree_sizes(self):
+        def compute():
+            sizes = np.ones(len(self.parent_rows), dtype=np.int64)
+            for level in reversed(self.levels[1:]):
+                np.add.at(sizes, self.parent_rows[level], sizes[level])
+            return sizes
+        return self.cached('subtree_sizes', compute)
+
+    # depth first preorder of the rooted rows: each child follows its parent
+    # and the whole subtrees of its earlier siblings
+    @property
+    def dfs_order(self):
+        def compute():
+            sizes = self.subtree_sizes
+            indptr, children = self.children_indptr, self.children
+            position = np.zeros(len(self.parent_rows), dtype=np.int64)
+            roots = self.roots[self.rooted[self.roots]]
+            position[roots] = np.cumsum(sizes[roots]) - sizes[roots]
+            for level in self.levels[:-1]:
+                counts = indptr[level + 1] - indptr[level]
+                first = np.repeat(np.cumsum(counts) - counts, counts)
+                kids = children[np.repeat(indptr[level], counts) + np.arange(len(first)) - first]
+                before = np.cumsum(sizes[kids]) - sizes[kids]
+                position[kids] = np.repeat(position[level], counts) + 1 + before - before[first]
+            rooted = np.flatnonzero(self.rooted)
+            order = np.empty(len(rooted), dtype=np.int64)
+            order[position[rooted]] = rooted
+            return order
+        return self.cached('dfs_order', compute)
+
+    # rows from row up to its root, row first
+    def path_to_root(self, row):
+        path = [row]
+        for _ in range(len(self.parent_rows)):
+            parent = int(self.parent_rows[path[-1]])
+            if parent == -1:
+                break
+            path.append(parent)
+        return np.array(path, dtype=np.int64)
+
+    # parent rows after making row the root of its tree: only the links on
+    # its path to the old root change direction
+    def rerooted(self, row):
+        path = self.path_to_root(row)
+        parent_rows = self.parent_rows.copy()
+        parent_rows[path[1:]] = path[:-1]
+        parent_rows[row] = -1
+        return parent_rows
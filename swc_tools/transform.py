@@ -0,0 +1,195 @@
+import os
+import re
+import sys
+import numpy as np
+from morphology import load_swc, save_swc
+from swc_binary import is_swcb, open_swcb, chunks, map_swcb
+from hoc_model import NUMBER, PT3DADD
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common_tools'))
+from instrument import stage, count
+
+# one affine map of x, y, z (a 4x4 matrix acting on column vectors) together
+# with the factor radii and diameters are multiplied by
+class Transform(object):
+
+    def __init__(self, matrix=None, radius_scale=1.0):
+        self.matrix = np.eye(4) if matrix is None else np.asarray(matrix, dtype=np.float64)
+        self.radius_scale = float(radius_scale)
+
+    # this transform followed by other, as a single transform
+    def then(self, other):
+        return Transform(other.matrix.dot(self.matrix), self.radius_scale * other.radius_scale)
+
+    def apply_points(self, xyz):
+        linear, shift = self.matrix[:3, :3], self.matrix[:3, 3]
+        # axis aligned maps (all the command line steps) skip the products
+        # with zero, which would also turn -0.0 into 0.0
+        if np.count_nonzero(linear - np.diag(np.diagonal(linear))) == 0:
+            xyz = xyz * np.diagonal(linear)
+        else:
+            xyz = xyz.dot(linear.T)
+        return xyz + shift if np.any(shift) else xyz
+
+    def apply_radii(self, radii):
+        return radii * self.radius_scale
+
+def translation(dx, dy, dz):
+    matrix = np.eye(4)
+    matrix[:3, 3] = (dx, dy, dz)
+    return Transform(matrix)
+
+def scaling(sx, sy, sz, radius_scale=1.0):
+    return Transform(np.diag((sx, sy, sz, 1.0)), radius_scale)
+
+# command line steps: each name takes the listed number of float arguments;
+# center moves the mean of the points (after the steps before it) to 0, 0, 0
+STEPS = {'translate': 3, 'scale': 3, 'radius': 1, 'anisotropy': 1, 'center': 0}
+
+def parse_steps(args):
+    steps = []
+    i = 0
+    while i < len(args):
+        name = args[i]
+        if name not in STEPS:
+            raise ValueError('unknown transform step "' + name + '", expected one of ' + ', '.join(sorted(STEPS)))
+        values = args[i + 1:i + 1 + STEPS[name]]
+        if len(values) != STEPS[name]:
+            raise ValueError(name + ' takes ' + str(STEPS[name]) + ' value(s)')
+        steps.append((name, tuple(float(v) for v in values)))
+        i += 1 + STEPS[name]
+    return steps
+
+def needs_mean(steps):
+    return any(name == 'center' for name, _ in steps)
+
+# folds the steps into one transform; mean is the mean input point, only
+# needed when a center step is present, since the mean of an affine image is
+# the image of the mean
+def compose(steps, mean=None):
+    transform = Transform()
+    for name, values in steps:
+        if name == 'translate':
+            step = translation(*values)
+        elif name == 'scale':
+            step = scaling(*values)
+        elif name == 'radius':
+            step = Transform(radius_scale=values[0])
+        elif name == 'anisotropy':
+            step = scaling(1.0, 1.0, values[0])
+        else:
+            step = translation(*-transform.apply_points(np.asarray(mean, dtype=np.float64)))
+        transform = transform.then(step)
+    return transform
+
+def transform_morphology(morphology, transform):
+    morphology.xyz = transform.apply_points(morphology.xyz)
+    morphology.radii = transform.apply_radii(morphology.radii)
+
+# applies parsed steps to a morphology in memory
+def apply_steps(morphology, steps):
+    mean = morphology.xyz.mean(axis=0) if needs_mean(steps) and len(morphology) else np.zeros(3)
+    transform_morphology(morphology, compose(steps, mean))
+
+def transform_swc(swc_path, out_path, steps):
+    morphology = load_swc(swc_path)
+    apply_steps(morphology, steps)
+    save_swc(morphology, out_path)
+
+def transform_swcb(src_path, dst_path, steps):
+    mean = np.zeros(3)
+    if needs_mean(steps):
+        src = open_swcb(src_path)
+        for start, stop in chunks(len(src)):
+            mean += src['xyz'][start:stop].sum(axis=0)
+        mean /= max(len(src), 1)
+    transform = compose(steps, mean)
+
+    def apply(chunk, start, stop):
+        chunk['xyz'] = transform.apply_points(chunk['xyz'])
+        chunk['radius'] = transform.apply_radii(chunk['radius'])
+    map_swcb(src_path, dst_path, apply)
+
+# text formats are rewritten in place: every coordinate group is matched,
+# parsed into one array, transformed at once and spliced back, leaving all
+# other text untouched
+NML_NODE = re.compile(r'<node\b[^>]*>')
+NML_FIELDS = ('x', 'y', 'z', 'radius')
+NML_ATTRIBUTES = dict((name, re.compile(r'\b' + name + r'="' + NUMBER + '"')) for name in NML_FIELDS)
+
+# replaces the text at each (start, stop) span
+def splice(text, spans, replacements):
+    pieces = []
+    last = 0
+    for (start, stop), replacement in zip(spans, replacements):
+        pieces.append(text[last:start])
+        pieces.append(replacement)
+        last = stop
+    pieces.append(text[last:])
+    return ''.join(pieces)
+
+# applies steps to the x, y, z and diameter of every pt3dadd call of hoc
+# text, keeping every other statement (nseg, insert, define_shape...) as it
+# is; numbers are written in their shortest exact form
+def transform_hoc_text(text, steps):
+    # split leaves the text between matches at every fifth place, the four
+    # numbers of each match in between
+    parts = PT3DADD.split(text)
+    numbers = parts[1:]
+    del numbers[4::5]
+    values = np.array(numbers, dtype=np.float64).reshape(-1, 4)
+    transform = compose(steps, values[:, :3].mean(axis=0) if len(values) else np.zeros(3))
+    values = np.column_stack((transform.apply_points(values[:, :3]), transform.apply_radii(values[:, 3])))
+    template = 'pt3dadd(%r, %r, %r, %r)'.join(part.replace('%', '%%') for part in parts[0::5])
+    return template % tuple(values.ravel().tolist())
+
+# applies steps to the x, y, z and radius attributes of every nml node
+def transform_nml_text(text, steps):
+    nodes = list(NML_NODE.finditer(text))
+    fields = [[NML_ATTRIBUTES[name].search(node.group(0)) for name in NML_FIELDS] for node in nodes]
+    values = np.array([[float(m.group(1)) if m else np.nan for m in found] for found in fields]).reshape(-1, 4)
+    xyz = np.nan_to_num(values[:, :3])
+    transform = compose(steps, xyz.mean(axis=0) if len(xyz) else np.zeros(3))
+    new_values = np.column_stack((transform.apply_points(xyz), transform.apply_radii(values[:, 3]))).tolist()
+
+    replacements = []
+    for node, found, new in zip(nodes, fields, new_values):
+        edits = sorted((m.span(1), '%r' % v) for m, v in zip(found, new) if m)
+        replacements.append(splice(node.group(0), [span for span, _ in edits], [value for _, value in edits]))
+    return splice(text, [node.span() for node in nodes], replacements)
+
+def transform_text(in_path, out_path, steps, rewrite):
+    with stage('read'):
+        with open(in_path, 'r') as f:
+            text = f.read()
+        count('bytes_read', len(text))
+    with stage('transform'):
+        text = rewrite(text, steps)
+    with stage('write'):
+        with open(out_path, 'w') as f:
+            f.write(text)
+        count('bytes_written', len(text))
+
+# applies a chain of steps to an .swc, .swcb, .hoc or .nml file in one pass,
+# writing <name>_transformed with the same extension
+def transform_file(path, steps):
+    stem, extension = path.rsplit('.', 1)
+    out_path = stem + '_transformed.' + extension
+    if is_swcb(path):
+        transform_swcb(path, out_path, steps)
+    elif extension == 'hoc':
+        transform_text(path, out_path, steps, transform_hoc_text)
+    elif extension == 'nml':
+        transform_text(path, out_path, steps, transform_nml_text)
+    else:
+        transform_swc(path, out_path, steps)
+    return out_path
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print('\nTRANSFORM -- apply a chain of coordinate transforms in one pass')
+        print('Usage: python transform.py ["path/to/file.swc" || ".swcb" || ".hoc" || ".nml"] [step] [values] [step] [values] ...')
+        print('Steps: translate dx dy dz, scale sx sy sz, radius factor, anisotropy z-factor, center')
+        print('Example: python transform.py cell.swc anisotropy 5.4545 center scale 0.5 0.5 0.5')
+    else:
+        print(transform_file(sys.argv[1], parse_steps(sys.argv[2:])))
@@ -0,0 +1,76 @@
+import os
+import sys
+import numpy as np
+from morphology import write_table
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common_tools'))
+from instrument import count, enabled
+
+# ring vertices per node when no count is given
+SEGMENTS = 8
+
+# surface mesh of tubes along every edge of a morphology: each node gets a
+# ring of segments vertices at its radius, perpendicular to the edge to its
+# parent (to its first child for roots), and the rings of a node and its
+# parent are joined by 2 * segments triangles; roots and leaves are closed
+# with a fan around their centre. Returns float vertices (V, 3) and 0-based
+# vertex indices of the triangles (F, 3), wound with normals facing out
+def tube_mesh(morphology, segments=SEGMENTS, caps=True):
+    topology = morphology.topology()
+    parent_rows = topology.parent_rows
+    xyz = morphology.xyz
+    n = len(parent_rows)
+
+    linked = np.flatnonzero(parent_rows != -1)
+    axis = np.zeros((n, 3))
+    axis[linked] = xyz[linked] - xyz[parent_rows[linked]]
+    roots = topology.roots[topology.child_counts[topology.roots] > 0]
+    axis[roots] = xyz[topology.children[topology.children_indptr[roots]]] - xyz[roots]
+    length = np.sqrt((axis ** 2).sum(axis=1))
+    axis[length == 0] = (0, 0, 1)
+    axis /= np.where(length == 0, 1, length)[:, None]
+
+    # two unit vectors spanning the plane of each ring, (u, v, axis) right handed
+    helper = np.zeros((n, 3))
+    helper[np.abs(axis[:, 0]) < 0.9, 0] = 1
+    helper[np.abs(axis[:, 0]) >= 0.9, 1] = 1
+    u = np.cross(axis, helper)
+    u /= np.sqrt((u ** 2).sum(axis=1))[:, None]
+    v = np.cross(axis, u)
+
+    angles = 2 * np.pi * np.arange(segments) / segments
+    offsets = np.cos(angles)[None, :, None] * u[:, None, :] + np.sin(angles)[None, :, None] * v[:, None, :]
+    vertices = (xyz[:, None, :] + morphology.radii[:, None, None] * offsets).reshape(-1, 3)
+
+    # two triangles per ring segment between every node and its parent
+    k = np.arange(segments)
+    k1 = (k + 1) % segments
+    child = linked[:, None] * segments
+    parent = parent_rows[linked][:, None] * segments
+    sides = np.stack((np.stack(np.broadcast_arrays(child + k, parent + k1, child + k1), axis=-1),
+                      np.stack(np.broadcast_arrays(child + k, parent + k, parent + k1), axis=-1)), axis=2)
+    faces = [sides.reshape(-1, 3)]
+    if caps:
+        vertices, faces = add_caps(vertices, faces, xyz, topology, segments, k, k1)
+    return vertices, np.concatenate(faces)
+
+def add_caps(vertices, faces, xyz, topology, segments, k, k1):
+    n = len(xyz)
+    leaves = np.flatnonzero(topology.leaf_mask)
+    roots = topology.roots
+    ends = np.concatenate((leaves, roots))
+    centers = (n * segments + np.arange(len(ends)))[:, None]
+    rings = ends[:, None] * segments
+    # leaves face along their axis, roots against it
+    fans = np.stack(np.broadcast_arrays(centers, rings + k, rings + k1), axis=-1)
+    fans[len(leaves):] = fans[len(leaves):][:, :, [0, 2, 1]]
+    return np.concatenate((vertices, xyz[ends])), faces + [fans.reshape(-1, 3)]
+
+def write_obj_mesh(obj_path, vertices, faces):
+    with open(obj_path, 'w') as f:
+        write_table(f, 'v %.3f %.3f %.3f', vertices)
+        write_table(f, 'f %d %d %d', faces + 1)
+        count('vertices_written', len(vertices))
+        count('faces_written', len(faces))
+        if enabled():
+            count('bytes_written', f.tell())
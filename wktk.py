@@ -0,0 +1,107 @@
+import os
+import sys
+
+# one entry point for every tool: "python wktk.py swc2hoc dendrite.swc soma.swc"
+# runs swc_tools/swc2hoc.py exactly as if it had been started directly. Only
+# os and sys are imported here, so listing the commands never pays for
+# numpy; a tool's modules are imported when that tool runs
+
+TOOLKIT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# command -> (folder, script, summary)
+COMMANDS = {
+    'nml2swc': ('nml_tools', 'nml2swc.py', 'convert .nml skeletons to .swc'),
+    'nml_merger': ('nml_tools', 'nml_merger.py', 'merge a folder of .nml files into one'),
+    'nml_splitter': ('nml_tools', 'nml_splitter.py', 'split an .nml into one file per thing'),
+    'swc2hoc': ('swc_tools', 'swc2hoc.py', 'convert a dendrite and soma .swc to .hoc'),
+    'swc2obj': ('swc_tools', 'swc2obj.py', 'export an .swc as points or a tube mesh'),
+    'swc2pt3dadd': ('swc_tools', 'swc2pt3dadd.py', 'write an .swc as pt3dadd lines'),
+    'swc_binary': ('swc_tools', 'swc_binary.py', 'convert between .swc and binary .swcb'),
+    'swc_center': ('swc_tools', 'swc_center.py', 'move an .swc to its centroid'),
+    'swc_components': ('swc_tools', 'swc_components.py', 'label the connected components of an .swc'),
+    'swc_corrector': ('swc_tools', 'swc_corrector.py', 'renumber an .swc to consecutive ids'),
+    'swc_cyclebreaker': ('swc_tools', 'swc_cyclebreaker.py', 'remove cycles from an .swc'),
+    'swc_smoother': ('swc_tools', 'swc_smoother.py', 'smooth the radii of an .swc'),
+    'swc_offset': ('swc_tools', 'swc_offset.py', 'translate an .swc'),
+    'transform': ('swc_tools', 'transform.py', 'apply scale, anisotropy and offset steps to .swc or .hoc'),
+    'run': ('swc_tools', 'pipeline.py', 'chain swc tools on one skeleton in memory'),
+    'hoc_scaler': ('hoc_tools', 'hoc_scaler.py', 'scale the coordinates of a .hoc'),
+    'zip_splitter': ('zip_tools', 'zip_splitter.py', 'split segmentation zips into one zip per label'),
+    'zip_stats': ('zip_tools', 'zip_stats.py', 'per label statistics of segmentation zips'),
+    'zip_mesh': ('zip_tools', 'zip_mesh.py', 'surface meshes of the labels of segmentation zips'),
+    'synthetic': ('bench_tools', 'synthetic.py', 'generate synthetic .swc, .nml and .zip inputs'),
+    'benchmark': ('bench_tools', 'benchmark.py', 'time the tools against saved baselines'),
+    'instrument': ('common_tools', 'instrument.py', 'sum the stages of WKTK_TRACE files'),
+}
+
+# arguments of each command, printed by "wktk.py help [command]" without
+# importing the tool; every line matches the tool's own usage text, so a
+# change to one must be made to the other
+USAGE = {
+    'nml2swc': ('["path/to/nml/file.nml" || "path/to/nml/folder"] [radius] [-j workers]',
+                'Note: radius argument is optional; radius from nml will be used by default'),
+    'nml_merger': ('["path/to/nml/folder"] ["path/to/output/file.nml"] [-j workers]',
+                   'Note: workers argument is optional; one worker per cpu is used by default'),
+    'nml_splitter': ('["path/to/nml/file.nml" || "path/to/nml/folder"] [-j workers]',),
+    'swc2hoc': ('[dendriteSkeleton.swc] [somaSkeleton.swc]',),
+    'swc2obj': ('["path/to/swc/file.swc" || "path/to/swc/folder"] [points || tube] [ring segments] [-f obj || ply || glb] [-j workers]',),
+    'swc2pt3dadd': ('["path/to/swc/file.swc"]',),
+    'swc_binary': ('["path/to/file.swc" || "path/to/file.swcb"]',),
+    'swc_center': ('["path/to/swc/file.swc" || "path/to/file.swcb"]',),
+    'swc_components': ('["path/to/swc/file.swc"]',),
+    'swc_corrector': ('["path/to/swc/file.swc" || "path/to/file.swcb"]',),
+    'swc_cyclebreaker': ('["path/to/swc/file.swc"]',),
+    'swc_smoother': ('[path/to/swc/file.swc] [allowed change per node (i.e. 1.5)] [down || both || window] [window size]',
+                     'Note: the allowed change is a ratio of at least 1; 1.1 lets radii change by 10% per node'),
+    'swc_offset': ('["path/to/swc/file.swc" || "path/to/file.swcb"] [float x-offset] [float y-offset] [float z-offset]',),
+    'transform': ('["path/to/file.swc" || ".swcb" || ".hoc" || ".nml"] [step] [values] [step] [values] ...',
+                  'Steps: translate dx dy dz, scale sx sy sz, radius factor, anisotropy z-factor, center',
+                  'Example: python wktk.py transform cell.swc anisotropy 5.4545 center scale 0.5 0.5 0.5'),
+    'run': ('["path/to/file.nml" || ".swc" || ".swcb"] [stage] [args] + [stage] [args] ... [-o output]',
+            'Stages: nml2swc [radius], center, offset dx dy dz, transform [steps], correct, cyclebreak, components,',
+            '        smooth ratio [mode] [window], then optionally one of swc, swcb, swc2hoc soma.swc,',
+            '        swc2obj [points || tube] [segments] [-f format], swc2pt3dadd',
+            'Example: python wktk.py run cell.nml nml2swc + center + smooth 1.1 + swc2hoc soma.swc'),
+    'hoc_scaler': ('[path/to/hoc/file.hoc] [x-multiplier] [y-multiplier] [z-multiplier] [d-multiplier]',),
+    'zip_splitter': ('["path/to/multi_cells.zip"] [-j workers]',),
+    'zip_stats': ('["path/to/multi_cells.zip"] [-j workers]',),
+    'zip_mesh': ('["path/to/multi_cells.zip"] [obj || glb || ply] [decimation step] [-z z-scale] [-j workers]',),
+    'synthetic': ('[swc || nml || zip] ["path/to/output"] [nodes, or cubes for zip] [seed]',),
+    'benchmark': ('[tool names...] [-s nodes,nodes,...] [-c cubes,cubes,...] [-r repeats] [--save]',),
+    'instrument': ('["path/to/trace.jsonl"] [more traces...]',),
+}
+
+def print_usage(name):
+    print('\n' + name.upper() + ' -- ' + COMMANDS[name][2])
+    print('Usage: python wktk.py ' + name + ' ' + USAGE[name][0])
+    for line in USAGE[name][1:]:
+        print(line)
+
+def print_commands():
+    print('\nWKTK -- webknossos_toolkit')
+    print('Usage: python wktk.py [command] [arguments of the command]')
+    print('       python wktk.py help [command]')
+    print('')
+    for name in sorted(COMMANDS):
+        print('  %-18s %s' % (name, COMMANDS[name][2]))
+
+# runs the command's script in this process under its own name, so it sees
+# the argv, sys.path and __main__ it would have seen when started directly
+def run_command(name, args):
+    import runpy
+    folder, script = COMMANDS[name][:2]
+    script_path = os.path.join(TOOLKIT_DIR, folder, script)
+    sys.path.insert(0, os.path.dirname(script_path))
+    sys.argv = [script_path] + list(args)
+    runpy.run_path(script_path, run_name='__main__')
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] in ('-h', '--help'):
+        print_commands()
+    elif sys.argv[1] == 'help' and len(sys.argv) == 3 and sys.argv[2] in COMMANDS:
+        print_usage(sys.argv[2])
+    elif sys.argv[1] not in COMMANDS:
+        print('\nERROR -- unknown command "' + sys.argv[1] + '", see python wktk.py --help')
+        sys.exit(1)
+    else:
+        run_command(sys.argv[1], sys.argv[2:])
@@ -0,0 +1,183 @@
+import os
+import sys
+import functools
+import multiprocessing
+import multiprocessing.util
+from collections import OrderedDict
+import numpy as np
+from zip_splitter import read_cube, close_archives, unpack_nested, remove_unpacked
+from zip_stats import cube_position, voxel_coordinates, label_index, index_path, save_index, load_index
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'swc_tools'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common_tools'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'nml_tools'))
+from tube_mesh import write_obj_mesh
+from mesh_export import EXPORTERS
+from batch import pop_workers, pop_option
+from instrument import stage
+from nml2swc import Z_ANISOTROPY
+
+# text obj, or the binary formats swc2obj writes
+MESH_FORMATS = ('obj',) + tuple(sorted(EXPORTERS))
+
+# the two axes spanning a face normal to each axis, ordered so that their
+# cross product points along it
+FACE_AXES = ((1, 2), (2, 0), (0, 1))
+
+# decoded cubes kept by each process, least recently used first; labels are
+# meshed in the order of the first cube they appear in, so the labels one
+# worker meshes in a row mostly share their cubes
+CUBE_CACHE_SIZE = 16
+CUBES = OrderedDict()
+
+def cached_cube(zip_path, member):
+    key = (zip_path, member)
+    if key in CUBES:
+        CUBES.move_to_end(key)
+    else:
+        if len(CUBES) >= CUBE_CACHE_SIZE:
+            CUBES.popitem(last=False)
+        CUBES[key] = read_cube(zip_path, member)
+    return CUBES[key]
+
+def release_cubes():
+    CUBES.clear()
+    close_archives()
+
+# pool workers keep the input archive and their cubes for every label they
+# mesh, and let go of them when they exit
+def start_worker():
+    multiprocessing.util.Finalize(None, release_cubes, exitpriority=10)
+
+# global voxel coordinates (N, 3) of one label, read from just the cubes
+# the label index lists for it
+def label_voxels(zip_path, label, members):
+    coordinates = voxel_coordinates()
+    voxels = []
+    for member in members:
+        inside = np.flatnonzero(cached_cube(zip_path, member) == label)
+        voxels.append(coordinates[:, inside].T + cube_position(member))
+    return np.concatenate(voxels) if voxels else np.empty((0, 3), dtype=np.int64)
+
+# packs lattice points inside lower..upper into single integers
+def point_keys(points, lower, shape):
+    shifted = points - lower
+    return (shifted[:, 0] * shape[1] + shifted[:, 1]) * shape[2] + shifted[:, 2]
+
+# one square per voxel side facing a voxel of another label, split into two
+# outward wound triangles; the voxels of every cube are looked up together,
+# so faces on cube seams are found like any other and corners shared across
+# seams become one vertex. Returns lattice vertices (V, 3) and faces (F, 3)
+def boundary_mesh(voxels):
+    if not len(voxels):
+        return np.empty((0, 3)), np.empty((0, 3), dtype=np.int64)
+    # room for the neighbours and corners one step outside the voxels
+    lower = voxels.min(axis=0) - 1
+    shape = voxels.max(axis=0) + 2 - lower
+    keys = np.sort(point_keys(voxels, lower, shape))
+
+    corners = []
+    for axis in range(3):
+        b, c = FACE_AXES[axis]
+        step_b, step_c = np.eye(3, dtype=np.int64)[b], np.eye(3, dtype=np.int64)[c]
+        for sign in (1, -1):
+            neighbours = voxels.copy()
+            neighbours[:, axis] += sign
+            neighbour_keys = point_keys(neighbours, lower, shape)
+            found = np.minimum(np.searchsorted(keys, neighbour_keys), len(keys) - 1)
+            facing = voxels[keys[found] != neighbour_keys]
+            base = facing.copy()
+            if sign == 1:
+                base[:, axis] += 1
+                quad = (base, base + step_b, base + step_b + step_c, base + step_c)
+            else:
+                quad = (base, base + step_c, base + step_b + step_c, base + step_b)
+            corners.append(np.stack((quad[0], quad[1], quad[2], quad[0], quad[2], quad[3]), axis=1).reshape(-1, 3, 3))
+
+    corners = np.concatenate(corners).reshape(-1, 3)
+    _, first, faces = np.unique(point_keys(corners, lower, shape), return_index=True, return_inverse=True)
+    return corners[first], faces.reshape(-1, 3)
+
+# vertex clustering: vertices are merged per cube of step voxels into their
+# mean, and triangles that collapse or repeat are dropped
+def decimate(vertices, faces, step):
+    cells = np.floor_divide(vertices, step)
+    cells, cluster = np.unique(cells, axis=0, return_inverse=True)
+    cluster = cluster.ravel()
+    counts = np.bincount(cluster, minlength=len(cells))
+    merged = np.column_stack([np.bincount(cluster, weights=vertices[:, axis], minlength=len(cells))
+                              for axis in range(3)]) / counts[:, None]
+    faces = cluster[faces]
+    keep = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])
+    faces = faces[keep]
+    _, first = np.unique(np.sort(faces, axis=1), axis=0, return_index=True)
+    return merged, faces[np.sort(first)]
+
+def mesh_path(zip_path, label, fmt):
+    return zip_path[:-4] + '_part' + str(label) + '.' + fmt
+
+# runs in a worker: meshes one label and writes its file
+def mesh_label(zip_path, fmt, step, z_scale, job):
+    label, members = job
+    with stage('read_voxels'):
+        voxels = label_voxels(zip_path, label, members)
+    with stage('boundary_mesh'):
+        vertices, faces = boundary_mesh(voxels)
+    vertices = vertices.astype(np.float64)
+    if step > 1 and len(faces):
+        with stage('decimate'):
+            vertices, faces = decimate(vertices, faces, step)
+    vertices[:, 2] *= z_scale
+    path = mesh_path(zip_path, label, fmt)
+    with stage('write'):
+        if fmt == 'obj':
+            write_obj_mesh(path, vertices, faces)
+        else:
+            EXPORTERS[fmt](path, vertices, faces=faces)
+    return path
+
+# meshes every cell of a webKnossos zip as one batch, one label per task;
+# the label index says which cubes to read for each label and is reused
+# from a previous zip_stats run when it is newer than the zip. Each worker
+# gets runs of labels that start in neighbouring cubes. z is scaled like
+# nml2swc scales it, so the meshes line up with the skeletons by default
+def mesh_zip(zip_path, fmt='obj', step=1, z_scale=Z_ANISOTROPY, workers=None):
+    npz_path = index_path(zip_path)
+    if os.path.exists(npz_path) and os.path.getmtime(npz_path) >= os.path.getmtime(zip_path):
+        index = load_index(npz_path)
+    else:
+        index = label_index(zip_path, workers)
+        save_index(index, npz_path)
+
+    first_cubes = index.cube_rows[index.cube_offsets[:-1]]
+    order = np.lexsort((index.labels, first_cubes))
+    jobs = [(label, index.cubes_of(label)) for label in index.labels[order].tolist()]
+    mesh = functools.partial(mesh_label, zip_path, fmt, step, z_scale)
+    try:
+        if workers == 1 or len(jobs) <= 1:
+            paths = [mesh(job) for job in jobs]
+        else:
+            unpack_nested(zip_path, index.members)
+            close_archives()
+            pool = multiprocessing.Pool(workers, start_worker)
+            try:
+                chunk = max(1, len(jobs) // (4 * (workers or os.cpu_count() or 1)))
+                paths = list(pool.imap_unordered(mesh, jobs, chunk))
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        CUBES.clear()
+        remove_unpacked()
+    return paths
+
+if __name__ == "__main__":
+    workers = pop_workers(sys.argv)
+    z_scale = float(pop_option(sys.argv, ('-z', '--z-scale')) or Z_ANISOTROPY)
+    if len(sys.argv) < 2 or len(sys.argv) > 4 or (len(sys.argv) > 2 and sys.argv[2] not in MESH_FORMATS):
+        print('\nZIP_MESH -- surface mesh of every cell in a webKnossos zip')
+        print('Usage: python zip_mesh.py ["path/to/multi_cells.zip"] [obj || glb || ply] [decimation step] [-z z-scale] [-j workers]')
+    else:
+        paths = mesh_zip(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else 'obj',
+                         int(sys.argv[3]) if len(sys.argv) > 3 else 1, z_scale, workers)
+        print('Meshed ' + str(len(paths)) + ' cell(s) from ' + sys.argv[1])
@@ -0,0 +1,207 @@
+import os
+import re
+import sys
+import json
+import shutil
+import hashlib
+import zipfile
+import tempfile
+import functools
+import multiprocessing
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common_tools'))
+from batch import pop_workers
+from instrument import staged, count
+
+# webKnossos volume cubes: 128^3 little endian uint16 cell labels, 0 for none
+RAW_NAME = re.compile(r'mag1_x(\d+)_y(\d+)_z(\d+)\.raw$')
+VOXEL_DTYPE = np.dtype('<u2')
+
+# output masks are mostly zeros, so the fastest deflate level already
+# shrinks them to a fraction of their size
+COMPRESS_LEVEL = 1
+
+# labels whose parts one task writes, and so the most part archives a
+# process holds open at once, since a volume can hold more cells than a
+# process may open files
+MAX_OPEN_PARTS = 64
+
+# archives opened so far by this process, keyed by (zip path, nested zip
+# names...), so each worker opens the input once for all its cubes
+ARCHIVES = {}
+
+# temporary copies of compressed nested zips unpacked by this process
+UNPACKED = []
+
+# path of every raw cube as a tuple of member names, looking inside zips
+# nested in the archive (webKnossos puts the cubes in data.zip)
+def raw_members(zip_path, nested=()):
+    for info in open_archive(zip_path, nested).infolist():
+        if RAW_NAME.search(info.filename):
+            yield nested + (info.filename,)
+        elif info.filename.lower().endswith('.zip'):
+            for member in raw_members(zip_path, nested + (info.filename,)):
+                yield member
+
+# a stored nested zip is read in place; a compressed one is unpacked once to
+# a temporary file, since seeking back in a compressed member means
+# decompressing it again from the start. The copy is named after the input
+# and its size and mtime, so every worker of a run opens the copy the
+# process listing the cubes made instead of holding its own in memory
+def open_archive(zip_path, nested=()):
+    key = (zip_path,) + nested
+    if key not in ARCHIVES:
+        if not nested:
+            ARCHIVES[key] = zipfile.ZipFile(zip_path)
+        else:
+            parent = open_archive(zip_path, nested[:-1])
+            info = parent.getinfo(nested[-1])
+            if info.compress_type == zipfile.ZIP_STORED:
+                ARCHIVES[key] = zipfile.ZipFile(parent.open(info))
+            else:
+                ARCHIVES[key] = zipfile.ZipFile(unpack(zip_path, nested, parent, info))
+    return ARCHIVES[key]
+
+def unpacked_path(zip_path, nested):
+    stat = os.stat(zip_path)
+    key = json.dumps([os.path.abspath(zip_path), stat.st_size, stat.st_mtime_ns] + list(nested))
+    return os.path.join(tempfile.gettempdir(), 'wktk_' + hashlib.sha1(key.encode()).hexdigest()[:16] + '.zip')
+
+def unpack(zip_path, nested, parent, info):
+    path = unpacked_path(zip_path, nested)
+    if not os.path.exists(path):
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with parent.open(info) as src, open(tmp_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        os.replace(tmp_path, path)
+        UNPACKED.append(path)
+    return path
+
+# opens the nested zips holding members in this process, so compressed ones
+# are unpacked before any worker needs them
+def unpack_nested(zip_path, members):
+    for nested in set(member[:-1] for member in members):
+        open_archive(zip_path, nested)
+
+def close_archives():
+    for archive in ARCHIVES.values():
+        archive.close()
+    ARCHIVES.clear()
+
+# deletes the copies this process unpacked; called by the process that
+# listed the cubes once its workers are done
+def remove_unpacked():
+    close_archives()
+    for path in UNPACKED:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    del UNPACKED[:]
+
+def read_cube(zip_path, member):
+    data = open_archive(zip_path, member[:-1]).read(member[-1])
+    count('cubes_read')
+    count('bytes_read', len(data))
+    return np.frombuffer(data, dtype=VOXEL_DTYPE)
+
+# labels present in a cube, found in one counting pass over its voxels
+def cube_labels(cube):
+    return np.flatnonzero(np.bincount(cube)[1:]) + 1
+
+# runs in a worker: the labels of one cube
+@staged('cube_labels')
+def labels_in_cube(zip_path, member):
+    return cube_labels(read_cube(zip_path, member))
+
+def part_path(zip_path, label):
+    return zip_path[:-4] + '_part' + str(label) + '.zip'
+
+# runs in a worker: writes the whole part of each label of one group. The
+# group's cubes are read once each, in file order, and every label they
+# hold gets its mask cube, 1 where the label is, deflated by zipfile
+@staged('write_parts')
+def write_parts(zip_path, job):
+    parts = {}
+    try:
+        for member, labels in job:
+            cube = read_cube(zip_path, member)
+            for label in labels:
+                if label not in parts:
+                    parts[label] = zipfile.ZipFile(part_path(zip_path, label), 'w', zipfile.ZIP_DEFLATED,
+                                                   compresslevel=COMPRESS_LEVEL)
+                name = os.path.basename(member[-1])
+                parts[label].writestr(name, (cube == label).astype(VOXEL_DTYPE).tobytes())
+                count('bytes_written', parts[label].getinfo(name).compress_size)
+    finally:
+        for part in parts.values():
+            part.close()
+    return len(parts)
+
+# splits the labels into groups of at most MAX_OPEN_PARTS, each listing
+# (cube, labels of the group in it) in cube order. Labels are grouped in the
+# order of the first cube they appear in, so a group spans few cubes
+def part_jobs(members, cube_label_lists):
+    rows = np.concatenate([np.full(len(labels), row, dtype=np.int64) for row, labels in enumerate(cube_label_lists)])
+    labels = np.concatenate(cube_label_lists)
+    first = {}
+    for label, row in zip(labels.tolist(), rows.tolist()):
+        first.setdefault(label, row)
+    ordered = sorted(first, key=lambda label: (first[label], label))
+    group_of = dict((label, i // MAX_OPEN_PARTS) for i, label in enumerate(ordered))
+
+    jobs = [[] for _ in range(-(-len(ordered) // MAX_OPEN_PARTS))]
+    for row, cube in enumerate(cube_label_lists):
+        in_cube = {}
+        for label in cube.tolist():
+            in_cube.setdefault(group_of[label], []).append(label)
+        for group, group_labels in in_cube.items():
+            jobs[group].append((members[row], group_labels))
+    return jobs
+
+# writes one zip per cell label holding a mask cube for every cube the cell
+# appears in. A first parallel pass lists the labels of every cube; then
+# each task writes the complete parts of one group of labels, so no file is
+# shared between processes, a task never holds more than MAX_OPEN_PARTS
+# archives open and compression runs in every worker. Returns the labels
+# found
+def split_zip(zip_path, workers=None):
+    try:
+        members = list(raw_members(zip_path))
+    finally:
+        close_archives()
+
+    pool = multiprocessing.Pool(workers) if workers != 1 and len(members) > 1 else None
+    try:
+        find_labels = functools.partial(labels_in_cube, zip_path)
+        if pool:
+            cube_label_lists = pool.map(find_labels, members)
+        else:
+            cube_label_lists = [find_labels(member) for member in members]
+        if not any(len(cube) for cube in cube_label_lists):
+            return []
+        jobs = part_jobs(members, cube_label_lists)
+
+        write = functools.partial(write_parts, zip_path)
+        if pool and len(jobs) > 1:
+            for _ in pool.imap_unordered(write, jobs):
+                pass
+        else:
+            for job in jobs:
+                write(job)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        remove_unpacked()
+    return np.unique(np.concatenate(cube_label_lists)).tolist()
+
+if __name__ == "__main__":
+    workers = pop_workers(sys.argv)
+    if len(sys.argv) != 2:
+        print('\nZIP_SPLITTER -- Written by Nathan Spencer 2016')
+        print('Usage: python zip_splitter.py ["path/to/multi_cells.zip"] [-j workers]')
+    else:
+        labels = split_zip(sys.argv[1], workers)
+        print('Split ' + str(len(labels)) + ' cell(s) from ' + sys.argv[1])
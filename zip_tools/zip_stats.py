@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import functools
+import multiprocessing
+import numpy as np
+from zip_splitter import RAW_NAME, raw_members, read_cube, close_archives, remove_unpacked
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common_tools'))
+from batch import ordered_results, pop_workers
+from instrument import stage, staged
+
+# voxels along each edge of a cube; voxel i of a cube file lies at
+# x = i % 128, y = i // 128 % 128, z = i // 128^2 within the cube
+CUBE_EDGE = 128
+
+# x, y and z of every voxel of a cube, built once per process
+COORDINATES = []
+
+def voxel_coordinates():
+    if not COORDINATES:
+        i = np.arange(CUBE_EDGE ** 3, dtype=np.int64)
+        COORDINATES.append(np.stack((i % CUBE_EDGE, i // CUBE_EDGE % CUBE_EDGE, i // CUBE_EDGE ** 2)))
+    return COORDINATES[0]
+
+def cube_position(member):
+    return [int(v) * CUBE_EDGE for v in RAW_NAME.search(member[-1]).groups()]
+
+# runs in a worker: labels in one cube with their voxel counts, coordinate
+# sums and bounding box corners in dataset coordinates, from a few bincount
+# passes over the cube; labels are first mapped to 0..k-1 so every table
+# stays k rows long whatever the label values are
+@staged('cube_stats')
+def cube_stats(zip_path, member):
+    cube = read_cube(zip_path, member)
+    coordinates = voxel_coordinates()
+    counts = np.bincount(cube)
+    labels = np.flatnonzero(counts[1:]) + 1
+    k = len(labels)
+    compact = np.full(len(counts), k, dtype=np.int64)
+    compact[labels] = np.arange(k)
+    compact = compact[cube]
+
+    position = np.array(cube_position(member))
+    sums = np.empty((k, 3))
+    lower = np.empty((k, 3), dtype=np.int64)
+    upper = np.empty((k, 3), dtype=np.int64)
+    for axis in range(3):
+        sums[:, axis] = np.bincount(compact, weights=coordinates[axis], minlength=k + 1)[:k]
+        # which planes along this axis each label appears in
+        present = np.bincount(compact * CUBE_EDGE + coordinates[axis], minlength=(k + 1) * CUBE_EDGE)
+        present = present[:k * CUBE_EDGE].reshape(k, CUBE_EDGE) > 0
+        lower[:, axis] = present.argmax(axis=1)
+        upper[:, axis] = CUBE_EDGE - 1 - present[:, ::-1].argmax(axis=1)
+    counts = counts[labels]
+    return labels, counts, sums + counts[:, None] * position, lower + position, upper + position
+
+class LabelIndex(object):
+
+    def __init__(self, labels, counts, lower, upper, centroids, cube_offsets, cube_rows, members):
+        # one row per label, sorted by label
+        self.labels = labels
+        self.counts = counts
+        self.lower = lower
+        self.upper = upper
+        self.centroids = centroids
+        # rows into members of the cubes holding label i are
+        # cube_rows[cube_offsets[i]:cube_offsets[i + 1]]
+        self.cube_offsets = cube_offsets
+        self.cube_rows = cube_rows
+        # every cube as a tuple of member names (see zip_splitter.raw_members)
+        self.members = members
+
+    def __len__(self):
+        return len(self.labels)
+
+    def row_of(self, label):
+        i = int(np.searchsorted(self.labels, label))
+        return i if i < len(self.labels) and self.labels[i] == label else -1
+
+    # member paths of the cubes holding label, so a tool can read just those
+    def cubes_of(self, label):
+        i = self.row_of(label)
+        if i == -1:
+            return []
+        return [self.members[row] for row in self.cube_rows[self.cube_offsets[i]:self.cube_offsets[i + 1]].tolist()]
+
+# merges per cube results: one row per (cube, label) is sorted by label and
+# reduced in segments
+def merge_stats(members, results):
+    if not any(len(result[0]) for result in results):
+        empty = np.empty((0, 3))
+        return LabelIndex(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), empty, empty, empty,
+                          np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int64), members)
+
+    rows = np.concatenate([np.full(len(result[0]), row, dtype=np.int64) for row, result in enumerate(results)])
+    labels, counts, sums, lower, upper = [np.concatenate(column) for column in zip(*results)]
+    order = np.argsort(labels, kind='stable')
+    labels, rows = labels[order], rows[order]
+    starts = np.flatnonzero(np.concatenate(([True], labels[1:] != labels[:-1])))
+
+    counts = np.add.reduceat(counts[order], starts)
+    sums = np.add.reduceat(sums[order], starts, axis=0)
+    return LabelIndex(labels[starts], counts, np.minimum.reduceat(lower[order], starts, axis=0),
+                      np.maximum.reduceat(upper[order], starts, axis=0), sums / counts[:, None],
+                      np.concatenate((starts, [len(labels)])), rows, members)
+
+# one pass over every cube of a webKnossos zip, in parallel like zip_splitter
+def label_index(zip_path, workers=None):
+    try:
+        members = list(raw_members(zip_path))
+    finally:
+        close_archives()
+    stats = functools.partial(cube_stats, zip_path)
+
+    pool = multiprocessing.Pool(workers) if workers != 1 and len(members) > 1 else None
+    try:
+        if pool:
+            results = [result for _, result in ordered_results(pool, stats, members, 2 * (workers or os.cpu_count() or 1))]
+        else:
+            results = [stats(member) for member in members]
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        remove_unpacked()
+    with stage('merge_stats'):
+        return merge_stats(members, results)
+
+def index_path(zip_path):
+    return zip_path[:-4] + '_labels.npz'
+
+def save_index(index, npz_path):
+    np.savez_compressed(npz_path, labels=index.labels, counts=index.counts, lower=index.lower, upper=index.upper,
+                        centroids=index.centroids, cube_offsets=index.cube_offsets, cube_rows=index.cube_rows,
+                        members=np.array(json.dumps([list(member) for member in index.members])))
+
+def load_index(npz_path):
+    with np.load(npz_path) as data:
+        return LabelIndex(data['labels'], data['counts'], data['lower'], data['upper'], data['centroids'],
+                          data['cube_offsets'], data['cube_rows'],
+                          [tuple(member) for member in json.loads(str(data['members']))])
+
+def print_index(index):
+    print('label voxels min_x min_y min_z max_x max_y max_z centroid_x centroid_y centroid_z cubes')
+    for i in range(len(index)):
+        print('%d %d %d %d %d %d %d %d %.1f %.1f %.1f %d' % ((index.labels[i], index.counts[i]) + tuple(index.lower[i]) +
+              tuple(index.upper[i]) + tuple(index.centroids[i]) + (index.cube_offsets[i + 1] - index.cube_offsets[i],)))
+
+if __name__ == "__main__":
+    workers = pop_workers(sys.argv)
+    if len(sys.argv) != 2:
+        print('\nZIP_STATS -- per cell voxel counts, bounding boxes and centroids of a webKnossos zip')
+        print('Usage: python zip_stats.py ["path/to/multi_cells.zip"] [-j workers]')
+    else:
+        index = label_index(sys.argv[1], workers)
+        save_index(index, index_path(sys.argv[1]))
+        print_index(index)